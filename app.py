@@ -1,10 +1,18 @@
 import asyncio
+import json
+import os
 import traceback
+from contextlib import aclosing, asynccontextmanager
+from typing import Optional
 
 from enrichmcp import EnrichMCP
 from fastmcp import FastMCP
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Header, HTTPException
+from fastapi.responses import FileResponse, StreamingResponse
 from log import logger
+from src import deployment_history, profiling
+from src.bundle_server import router as bundle_router
+from src.counters import get_counters, run_flusher
 from src.rn_gen import (
     build_and_update_in_supabase,
     build_and_upload_to_supabase,
@@ -13,25 +21,68 @@ from src.rn_gen import (
     generate_app,
     generate_metadata,
 )
+from src.rn_gen.batch import generate_apps_batch
+from src.rn_gen.scheduler import scheduler as llm_scheduler
+from src.single_flight import SingleFlight, request_key
 from src.supabase import download_from_bucket
 from src.supabase import supabase as supabase_client
 
 BACKEND_URL = "http://localhost:8001"
-app = FastAPI(title="MicroApp")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
 
-async def generate_app_wrapper(user_request: str) -> dict:
+_background_users = 0
+_background_tasks: list[asyncio.Task] = []
+
+
+@asynccontextmanager
+async def background_jobs(server=None):
+    """Run the counter flusher and deployment GC while any server is up.
+
+    Used as the lifespan of both the FastAPI app and the MCP server; the MCP
+    server may enter it once per connection, so the jobs are reference counted.
+    """
+    global _background_users
+    _background_users += 1
+    if _background_users == 1:
+        _background_tasks.append(asyncio.create_task(run_flusher(get_counters())))
+        if deployment_history.GC_INTERVAL_SECONDS > 0:
+            _background_tasks.append(
+                asyncio.create_task(deployment_history.run_garbage_collector())
+            )
     try:
+        yield
+    finally:
+        _background_users -= 1
+        if _background_users == 0:
+            while _background_tasks:
+                _background_tasks.pop().cancel()
+            try:
+                await asyncio.to_thread(get_counters().flush)
+            except Exception as e:
+                # The local log keeps the counts until the next start
+                logger.error(f"Final counter flush failed: {e}")
+
+
+app = FastAPI(title="MicroApp", lifespan=background_jobs)
+app.include_router(bundle_router)
+
+
+single_flight = SingleFlight()
+
+
+def _generate_app_job(user_request: str) -> dict:
+    with profiling.span("generate_app"):
         app_spec = generate_app(user_request)
+    with profiling.span("generate_metadata"):
         app_metadata = generate_metadata(user_request)
+    with profiling.span("build_and_upload"):
         success, deployment_id = build_and_upload_to_supabase(app_spec, app_metadata)
-        return {"success": success, "deployment_id": deployment_id}
-    except Exception as e:
-        return {"error": str(e)}
+    return {"success": success, "deployment_id": deployment_id}
 
 
-async def edit_app_wrapper(user_request: str, deployment_id: str) -> dict:
-    try:
+def _edit_app_job(user_request: str, deployment_id: str) -> dict:
+    with profiling.span("load_previous_app"):
         previous_app_code = download_from_bucket(f"{deployment_id}/app.jsx")
         previous_app_metadata = (
             supabase_client.table("mini_apps")
@@ -41,40 +92,186 @@ async def edit_app_wrapper(user_request: str, deployment_id: str) -> dict:
             .data[0]
         )
 
+    with profiling.span("edit_app"):
         app_spec = edit_app(user_request, previous_app_code)
+    with profiling.span("edit_app_metadata"):
         app_metadata = edit_app_metadata(user_request, previous_app_metadata)
+    with profiling.span("build_and_update"):
         success, new_deployment_id = build_and_update_in_supabase(
             app_spec, app_metadata, deployment_id
         )
 
-        return {
-            "success": success,
-            "new_deployment_id": new_deployment_id,
-        }
+    return {
+        "success": success,
+        "new_deployment_id": new_deployment_id,
+    }
+
+
+async def generate_app_wrapper(
+    user_request: str, idempotency_key: Optional[str] = None, profile: bool = False
+) -> dict:
+    try:
+        # Profiled runs are diagnostic, so they bypass request coalescing
+        if profile or profiling.consume_armed():
+            return await asyncio.to_thread(
+                profiling.run_profiled, "generate_app", _generate_app_job, user_request
+            )
+        return await single_flight.run(
+            request_key("generate", user_request, idempotency_key=idempotency_key),
+            lambda: asyncio.to_thread(_generate_app_job, user_request),
+        )
+    except Exception as e:
+        return {"error": str(e)}
+
+
+async def edit_app_wrapper(
+    user_request: str,
+    deployment_id: str,
+    idempotency_key: Optional[str] = None,
+    profile: bool = False,
+) -> dict:
+    try:
+        if profile or profiling.consume_armed():
+            return await asyncio.to_thread(
+                profiling.run_profiled,
+                "edit_app",
+                _edit_app_job,
+                user_request,
+                deployment_id,
+            )
+        return await single_flight.run(
+            request_key("edit", user_request, deployment_id, idempotency_key),
+            lambda: asyncio.to_thread(_edit_app_job, user_request, deployment_id),
+        )
     except Exception as e:
         return {"error": str(e)}
 
 
 @app.post("/create-app")
-async def create_app_request(user_request: str):
-    return await generate_app_wrapper(user_request)
+async def create_app_request(
+    user_request: str, idempotency_key: Optional[str] = None, profile: bool = False
+):
+    return await generate_app_wrapper(user_request, idempotency_key, profile)
+
+
+@app.post("/create-apps")
+async def create_apps_request(user_requests: list[str]):
+    """Generate many apps at once, streaming one NDJSON line per finished app."""
+
+    async def stream_results():
+        # Close the batch right away on disconnect so its rows are still inserted
+        async with aclosing(generate_apps_batch(user_requests)) as results:
+            async for item in results:
+                yield json.dumps(item) + "\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
+@app.get("/apps/{deployment_id}/versions")
+async def list_app_versions(deployment_id: str):
+    versions = await asyncio.to_thread(deployment_history.list_versions, deployment_id)
+    if versions is None:
+        raise HTTPException(status_code=404, detail="App not found")
+    return {"versions": versions}
+
+
+@app.post("/apps/{deployment_id}/rollback")
+async def rollback_app_request(deployment_id: str, version: int):
+    """Serve an earlier version of the app deployed at deployment_id."""
+    new_deployment_id = await asyncio.to_thread(
+        deployment_history.rollback_app, deployment_id, version
+    )
+    if new_deployment_id is None:
+        raise HTTPException(status_code=404, detail="App or version not found")
+    return {"success": True, "new_deployment_id": new_deployment_id}
+
+
+@app.post("/apps/{deployment_id}/downloads")
+async def record_download(deployment_id: str):
+    try:
+        get_counters().record_download(deployment_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"recorded": True}
+
+
+@app.post("/apps/{deployment_id}/ratings")
+async def record_rating(deployment_id: str, rating: float):
+    """Record a 1-5 rating; the app's average is updated on the next flush."""
+    try:
+        get_counters().record_rating(deployment_id, rating)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"recorded": True}
+
+
+@app.get("/counters")
+async def counter_stats():
+    """Pending counts and flush status of the download/rating counters."""
+    return get_counters().stats()
+
+
+@app.get("/llm/scheduler")
+async def llm_scheduler_stats():
+    """Queue depth, wait times and remaining rate limit budget of LLM calls."""
+    return llm_scheduler.stats()
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+@app.post("/admin/profiling/arm", dependencies=[Depends(require_admin)])
+async def arm_profiling(runs: int = 1):
+    """Profile the next `runs` generate/edit runs, whichever entry point they use."""
+    return {"armed_runs": profiling.arm(runs)}
+
+
+@app.post("/admin/deployments/gc", dependencies=[Depends(require_admin)])
+async def collect_deployment_garbage(
+    limit: int = deployment_history.GC_MAX_DEPLOYMENTS,
+):
+    """Delete storage of pruned builds and orphaned deployments right away."""
+    return await asyncio.to_thread(deployment_history.collect_garbage, limit=limit)
+
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    return {"profiles": profiling.list_profiles()}
+
+
+@app.get(
+    "/admin/profiles/{profile_id}/{artifact}", dependencies=[Depends(require_admin)]
+)
+async def download_profile_artifact(profile_id: str, artifact: str):
+    """Download stacks.txt, summary.txt or timeline.json of a profiled run."""
+    path = profiling.artifact_path(profile_id, artifact)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile artifact not found")
+    return FileResponse(path, filename=f"{profile_id}-{artifact}")
 
 
 # EnrichMCP app
 mcp = EnrichMCP(
     "MicroApp",
     description="Mobile app generation service",
+    lifespan=background_jobs,
 )
 
 
 @mcp.resource()
-async def generate_mobile_app(user_request: str) -> dict[str, str]:
+async def generate_mobile_app(
+    user_request: str, idempotency_key: Optional[str] = None
+) -> dict[str, str]:
     """This is a tool to generate a mobile app based on any user request. If a user asks for a mobile app, this tool will be used to generate the app.
     The mobile app will be generated using the user request and the app will be sent to the user's phone.
     Please notify the user that the app is being generated and will be sent to their phone soon.
     """
     try:
-        result = await generate_app_wrapper(user_request)
+        result = await generate_app_wrapper(user_request, idempotency_key)
         return {
             "message": "App generated successfully",
             "result": str(result),
@@ -90,13 +287,15 @@ async def generate_mobile_app(user_request: str) -> dict[str, str]:
 
 
 @mcp.resource()
-async def edit_mobile_app(user_request: str, deployment_id: str) -> dict[str, str]:
+async def edit_mobile_app(
+    user_request: str, deployment_id: str, idempotency_key: Optional[str] = None
+) -> dict[str, str]:
     """This is a tool to edit a mobile app based on any user request. If a user asks for a mobile app, this tool will be used to edit the app.
     The mobile app will be edited using the user request and the app will be sent to the user's phone.
     Please notify the user that the app is being edited and will be sent to their phone soon.
     """
     try:
-        result = await edit_app_wrapper(user_request, deployment_id)
+        result = await edit_app_wrapper(user_request, deployment_id, idempotency_key)
         return {
             "message": "App edited successfully",
             "result": str(result),
@@ -111,6 +310,74 @@ async def edit_mobile_app(user_request: str, deployment_id: str) -> dict[str, st
         }
 
 
+@mcp.resource()
+async def rollback_mobile_app(deployment_id: str, version: int) -> dict[str, str]:
+    """This is a tool to roll a mobile app back to an earlier version. Use it when a user wants to undo edits to an app.
+    Versions are numbered from 1 (the originally generated app) upwards.
+    """
+    try:
+        new_deployment_id = await asyncio.to_thread(
+            deployment_history.rollback_app, deployment_id, version
+        )
+        if new_deployment_id is None:
+            return {"message": "App or version not found"}
+        return {
+            "message": "App rolled back successfully",
+            "new_deployment_id": new_deployment_id,
+        }
+    except Exception as e:
+        print("--------------------------------")
+        print(f"Error rolling back app: {e}")
+        print(traceback.format_exc())
+        return {
+            "message": "Error rolling back app",
+            "error": str(e),
+        }
+
+
+@mcp.resource()
+async def record_app_event(
+    deployment_id: str, event: str, rating: Optional[float] = None
+) -> dict[str, str]:
+    """This is a tool to record that a user downloaded or rated a mobile app.
+    Use event "download" when the app is installed, or event "rating" with a rating from 1 to 5.
+    """
+    try:
+        if event == "download":
+            get_counters().record_download(deployment_id)
+        elif event == "rating" and rating is not None:
+            get_counters().record_rating(deployment_id, rating)
+        else:
+            raise ValueError('event must be "download", or "rating" with a rating')
+        return {"message": "Event recorded"}
+    except Exception as e:
+        return {
+            "message": "Error recording event",
+            "error": str(e),
+        }
+
+
+@mcp.resource()
+async def generate_mobile_apps(user_requests: list[str]) -> dict[str, str]:
+    """This is a tool to generate several mobile apps at once, one per user request in the list.
+    Use it when seeding many apps in one go instead of calling generate_mobile_app repeatedly.
+    """
+    try:
+        results = [item async for item in generate_apps_batch(user_requests)]
+        return {
+            "message": "Apps generated successfully",
+            "result": str(results),
+        }
+    except Exception as e:
+        print("--------------------------------")
+        print(f"Error generating apps: {e}")
+        print(traceback.format_exc())
+        return {
+            "message": "Error generating apps",
+            "error": str(e),
+        }
+
+
 if __name__ == "__main__":
     logger.info("Starting MicroApp...")
     mcp.run()
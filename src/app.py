@@ -1,8 +1,10 @@
 from fastapi import FastAPI, BackgroundTasks
 from src.rn_gen import generate_app, generate_metadata, build_and_upload_to_supabase
 from log import logger
+from src.bundle_server import router as bundle_router
 
 app = FastAPI(title="MicroApp")
+app.include_router(bundle_router)
 
 
 @app.get("/")
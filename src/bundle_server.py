@@ -0,0 +1,173 @@
+"""Serve deployed bundles with ETags, compression and an in-memory LRU."""
+
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Request, Response
+
+from src.compression import MIN_COMPRESS_BYTES, VARIANT_SUFFIXES, compress_variants
+from src.storage import StorageBackend, storage
+
+BUNDLE_CACHE_MAX_BYTES = int(os.getenv("BUNDLE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Build ids are fresh UUIDs and deployments are never rewritten in place
+CONTENT_ADDRESSED_ID = re.compile(
+    r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$"
+)
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+
+@dataclass
+class CachedBundle:
+    """A stored file together with its precompressed variants."""
+
+    etag: str
+    media_type: str
+    variants: dict[str, bytes] = field(default_factory=dict)
+
+    @property
+    def size(self) -> int:
+        return sum(len(body) for body in self.variants.values())
+
+
+def build_cached_bundle(
+    path: str, body: bytes, stored_variants: Optional[dict[str, bytes]] = None
+) -> CachedBundle:
+    """Cache entry for a file, using the variants stored at build time if any.
+
+    Without stored variants (older deployments) the file is compressed here,
+    at request-path levels.
+    """
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    bundle = CachedBundle(
+        etag=hashlib.sha256(body).hexdigest()[:32],
+        media_type=media_type,
+        variants={"identity": body},
+    )
+    bundle.variants.update(stored_variants or compress_variants(body, thorough=False))
+    return bundle
+
+
+class BundleCache:
+    """Byte-bounded LRU of recently served bundles."""
+
+    def __init__(self, max_bytes: int = BUNDLE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, CachedBundle] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CachedBundle]:
+        with self._lock:
+            bundle = self._entries.get(key)
+            if bundle is not None:
+                self._entries.move_to_end(key)
+            return bundle
+
+    def put(self, key: str, bundle: CachedBundle) -> None:
+        if bundle.size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key).size
+            self._entries[key] = bundle
+            self._size += bundle.size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.size
+
+
+def choose_encoding(accept_encoding: str, available: dict[str, bytes]) -> str:
+    """Pick the best available encoding allowed by an Accept-Encoding header."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        match = re.search(r"q=([0-9.]+)", params)
+        if match:
+            quality = float(match.group(1))
+        if name:
+            accepted[name.lower()] = quality
+
+    for encoding in ("br", "gzip"):
+        quality = accepted.get(encoding, accepted.get("*", 0))
+        if encoding in available and quality > 0:
+            return encoding
+    return "identity"
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+class BundleServer:
+    def __init__(self, backend: StorageBackend, cache: BundleCache):
+        self.backend = backend
+        self.cache = cache
+
+    def load(self, path: str) -> Optional[CachedBundle]:
+        bundle = self.cache.get(path)
+        if bundle is None:
+            body = self.backend.download(path)
+            if body is None:
+                return None
+            stored = {}
+            if len(body) >= MIN_COMPRESS_BYTES:
+                for encoding, suffix in VARIANT_SUFFIXES.items():
+                    variant = self.backend.download(path + suffix)
+                    if variant is not None:
+                        stored[encoding] = variant
+            bundle = build_cached_bundle(path, body, stored)
+            self.cache.put(path, bundle)
+        return bundle
+
+    def respond(self, request: Request, build_id: str, file_path: str) -> Response:
+        if ".." in build_id or "/" in build_id or ".." in file_path.split("/"):
+            raise HTTPException(status_code=400, detail="Invalid path")
+
+        bundle = self.load(f"deployments/{build_id}/{file_path or 'index.html'}")
+        if bundle is None:
+            raise HTTPException(status_code=404, detail="Not found")
+
+        encoding = choose_encoding(
+            request.headers.get("accept-encoding", ""), bundle.variants
+        )
+        suffix = "" if encoding == "identity" else f"-{encoding}"
+        etag = f'"{bundle.etag}{suffix}"'
+        headers = {
+            "ETag": etag,
+            "Cache-Control": (
+                IMMUTABLE_CACHE_CONTROL
+                if CONTENT_ADDRESSED_ID.match(build_id)
+                else REVALIDATE_CACHE_CONTROL
+            ),
+            "Vary": "Accept-Encoding",
+        }
+
+        if etag_matches(request.headers.get("if-none-match", ""), etag):
+            return Response(status_code=304, headers=headers)
+
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        body = bundle.variants[encoding]
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(len(body))
+            body = b""
+        return Response(content=body, media_type=bundle.media_type, headers=headers)
+
+
+bundle_server = BundleServer(storage, BundleCache())
+router = APIRouter()
+
+
+@router.api_route("/deployments/{build_id}/{file_path:path}", methods=["GET", "HEAD"])
+def serve_deployment_file(request: Request, build_id: str, file_path: str) -> Response:
+    return bundle_server.respond(request, build_id, file_path)
@@ -0,0 +1,41 @@
+"""Compressed variants of deployed files.
+
+Builds store a .gz and (when brotli is installed) a .br object next to every
+file of at least MIN_COMPRESS_BYTES, compressed at the highest levels. The
+bundle server serves those, and only compresses on the request path, at
+cheaper levels, for deployments built before variants were stored.
+"""
+
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+MIN_COMPRESS_BYTES = 1024
+# Content-Encoding of each variant and the suffix of its stored object
+VARIANT_SUFFIXES = {"gzip": ".gz", "br": ".br"}
+REQUEST_GZIP_LEVEL = int(os.getenv("BUNDLE_REQUEST_GZIP_LEVEL", "6"))
+REQUEST_BROTLI_QUALITY = int(os.getenv("BUNDLE_REQUEST_BROTLI_QUALITY", "4"))
+
+
+def compress_variants(body: bytes, thorough: bool = True) -> dict[str, bytes]:
+    """Return the compressed encodings of body, keyed by Content-Encoding.
+
+    thorough uses the maximum levels (for build time); otherwise levels cheap
+    enough for the request path are used. Small bodies are not compressed.
+    """
+    if len(body) < MIN_COMPRESS_BYTES:
+        return {}
+    variants = {
+        "gzip": gzip.compress(
+            body, compresslevel=9 if thorough else REQUEST_GZIP_LEVEL, mtime=0
+        )
+    }
+    if brotli is not None:
+        variants["br"] = brotli.compress(
+            body, quality=11 if thorough else REQUEST_BROTLI_QUALITY
+        )
+    return variants
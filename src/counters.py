@@ -0,0 +1,386 @@
+"""Write-behind counters for app downloads and ratings.
+
+Events are added to in-memory sharded counters and appended to a per-shard
+local log, then flushed to mini_apps every COUNTER_FLUSH_INTERVAL_SECONDS as
+one batched UPDATE of aggregated deltas. A flush rotates the shard logs and
+deletes the rotated segments once the UPDATE committed; segments left behind
+by a crash are replayed on startup, so counts are delivered at least once.
+
+Each process logs to its own COUNTER_LOG_DIR/<pid>/ directory and holds an
+exclusive flock on it. Directories whose lock is free belong to dead
+processes, and their segments are adopted on startup.
+"""
+
+import asyncio
+import fcntl
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Optional
+
+from sqlalchemy import Float, Integer, bindparam, case, cast, column, orm, values
+from sqlalchemy.exc import SQLAlchemyError
+
+from log import logger
+from src.models import AppVersion, MiniApp
+from src.supabase import Session
+
+COUNTER_LOG_DIR = Path(
+    os.getenv(
+        "COUNTER_LOG_DIR",
+        os.path.join(os.path.dirname(__file__), "..", "logs", "counters"),
+    )
+).resolve()
+COUNTER_SHARDS = int(os.getenv("COUNTER_SHARDS", "16"))
+COUNTER_FLUSH_INTERVAL_SECONDS = float(os.getenv("COUNTER_FLUSH_INTERVAL_SECONDS", "5"))
+COUNTER_FLUSH_BATCH_SIZE = int(os.getenv("COUNTER_FLUSH_BATCH_SIZE", "500"))
+LOCK_FILE = "lock"
+MIN_RATING = 1.0
+MAX_RATING = 5.0
+
+
+@dataclass
+class Delta:
+    """Counts accumulated for one deployment since the last flush."""
+
+    downloads: int = 0
+    rating_sum: float = 0.0
+    ratings: int = 0
+
+    def add(self, other: "Delta") -> None:
+        self.downloads += other.downloads
+        self.rating_sum += other.rating_sum
+        self.ratings += other.ratings
+
+
+def _merge(target: dict[str, Delta], deltas: dict[str, Delta]) -> None:
+    for key, delta in deltas.items():
+        target.setdefault(key, Delta()).add(delta)
+
+
+class _Shard:
+    def __init__(self, log_path: Path):
+        self.lock = threading.Lock()
+        self.deltas: dict[str, Delta] = {}
+        self.log_path = log_path
+        self.log = open(log_path, "a", encoding="utf-8")
+
+    def rotate(self) -> Path:
+        """Move the current log aside as a pending segment and start a new one."""
+        self.log.close()
+        segment = self.log_path.with_name(
+            f"{self.log_path.stem}.{time.time_ns()}.pending"
+        )
+        self.log_path.rename(segment)
+        self.log = open(self.log_path, "a", encoding="utf-8")
+        return segment
+
+
+def _parse_segment(path: Path) -> dict[str, Delta]:
+    deltas: dict[str, Delta] = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            # A crash can leave a truncated last line
+            if len(fields) != 3 or not line.endswith("\n"):
+                continue
+            deployment_id, downloads, rating = fields
+            delta = deltas.setdefault(deployment_id, Delta())
+            delta.downloads += int(downloads)
+            if rating:
+                delta.rating_sum += float(rating)
+                delta.ratings += 1
+    return deltas
+
+
+def _resolve_app_ids(session: orm.Session, deployment_ids: list[str]) -> dict[str, int]:
+    """Map deployment ids, current or from the version history, to app ids."""
+    app_ids = dict(
+        session.query(MiniApp.deployment_id, MiniApp.id).filter(
+            MiniApp.deployment_id.in_(deployment_ids)
+        )
+    )
+    missing = [d for d in deployment_ids if d not in app_ids]
+    if missing:
+        app_ids.update(
+            session.query(AppVersion.deployment_id, AppVersion.app_id).filter(
+                AppVersion.deployment_id.in_(missing)
+            )
+        )
+    return app_ids
+
+
+def _counter_columns(table, added_downloads, added_sum, added_ratings) -> dict:
+    """SET clause adding the deltas; evaluated against the old row, so rating
+    is a running mean."""
+    return {
+        "downloads": table.c.downloads + added_downloads,
+        "rating": case(
+            (added_ratings == 0, table.c.rating),
+            else_=(table.c.rating * table.c.rating_count + added_sum)
+            / (table.c.rating_count + added_ratings),
+        ),
+        "rating_count": table.c.rating_count + added_ratings,
+    }
+
+
+def _update_counters(session: orm.Session, rows: list[dict[str, Any]]) -> None:
+    table = MiniApp.__table__
+    if session.get_bind().dialect.name == "postgresql":
+        # One UPDATE ... FROM (VALUES ...) per batch; an executemany would
+        # cost a round trip per app with psycopg2
+        deltas = values(
+            column("app_id", Integer),
+            column("added_downloads", Integer),
+            column("added_sum", Float),
+            column("added_ratings", Integer),
+            name="deltas",
+        ).data([tuple(row.values()) for row in rows])
+        session.execute(
+            table.update()
+            .where(table.c.id == deltas.c.app_id)
+            .values(
+                _counter_columns(
+                    table,
+                    deltas.c.added_downloads,
+                    cast(deltas.c.added_sum, Float),
+                    deltas.c.added_ratings,
+                )
+            )
+        )
+        return
+
+    statement = (
+        table.update()
+        .where(table.c.id == bindparam("app_id"))
+        .values(
+            _counter_columns(
+                table,
+                bindparam("added_downloads"),
+                bindparam("added_sum"),
+                bindparam("added_ratings"),
+            )
+        )
+    )
+    session.execute(statement, rows)
+
+
+def _apply_deltas(deltas: dict[str, Delta]) -> tuple[int, int]:
+    """Add deltas to mini_apps in batched UPDATEs.
+
+    Returns:
+        The number of apps updated and of deployment ids that matched no app
+    """
+    with Session() as session:
+        try:
+            deployment_ids = list(deltas)
+            app_ids: dict[str, int] = {}
+            for start in range(0, len(deployment_ids), COUNTER_FLUSH_BATCH_SIZE):
+                app_ids.update(
+                    _resolve_app_ids(
+                        session,
+                        deployment_ids[start : start + COUNTER_FLUSH_BATCH_SIZE],
+                    )
+                )
+
+            per_app: dict[int, Delta] = {}
+            for deployment_id, delta in deltas.items():
+                if deployment_id in app_ids:
+                    per_app.setdefault(app_ids[deployment_id], Delta()).add(delta)
+
+            rows = [
+                {
+                    "app_id": app_id,
+                    "added_downloads": delta.downloads,
+                    "added_sum": delta.rating_sum,
+                    "added_ratings": delta.ratings,
+                }
+                for app_id, delta in per_app.items()
+            ]
+            for start in range(0, len(rows), COUNTER_FLUSH_BATCH_SIZE):
+                _update_counters(
+                    session, rows[start : start + COUNTER_FLUSH_BATCH_SIZE]
+                )
+            session.commit()
+        except SQLAlchemyError:
+            session.rollback()
+            raise
+
+    return len(per_app), len(deltas) - len(app_ids)
+
+
+def _claim(directory: Path) -> Optional[int]:
+    """Lock a process log directory; returns the lock fd, or None if it is in use."""
+    directory.mkdir(parents=True, exist_ok=True)
+    fd = os.open(directory / LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+class WriteBehindCounters:
+    def __init__(self, log_dir: Path = COUNTER_LOG_DIR, shards: int = COUNTER_SHARDS):
+        self.log_root = Path(log_dir)
+        self.log_dir = self.log_root / str(os.getpid())
+        self._lock_fd = _claim(self.log_dir)
+        if self._lock_fd is None:
+            raise RuntimeError(f"Counter log directory {self.log_dir} is in use")
+
+        self._flush_lock = threading.Lock()
+        # Deltas (and their log segments) not yet committed to the database
+        self._carry: dict[str, Delta] = {}
+        self._pending_segments: list[Path] = []
+        self._adopt_orphans()
+        self._recover()
+
+        self._shards = [_Shard(self.log_dir / f"shard-{i}.log") for i in range(shards)]
+
+        self.flushes = 0
+        self.last_flush_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def _adopt_orphans(self) -> None:
+        """Move the segments of dead processes' log directories into ours."""
+        for directory in sorted(self.log_root.iterdir()):
+            if not directory.is_dir() or directory == self.log_dir:
+                continue
+            fd = _claim(directory)
+            if fd is None:
+                continue
+            try:
+                for path in directory.glob("shard-*"):
+                    path.rename(self.log_dir / f"{path.stem}.{time.time_ns()}.pending")
+                (directory / LOCK_FILE).unlink(missing_ok=True)
+                directory.rmdir()
+            except OSError as e:
+                logger.warning(f"Could not adopt counter log {directory}: {e}")
+            finally:
+                os.close(fd)
+
+    def _recover(self) -> None:
+        for path in sorted(self.log_dir.glob("shard-*")):
+            if path.stat().st_size == 0:
+                path.unlink()
+                continue
+            if path.suffix == ".log":
+                path = path.rename(
+                    path.with_name(f"{path.stem}.{time.time_ns()}.pending")
+                )
+            _merge(self._carry, _parse_segment(path))
+            self._pending_segments.append(path)
+        if self._pending_segments:
+            logger.info(
+                f"Recovered counts for {len(self._carry)} deployments "
+                f"from {len(self._pending_segments)} log segments"
+            )
+
+    def _record(
+        self, deployment_id: str, downloads: int, rating: Optional[float]
+    ) -> None:
+        if not deployment_id or any(c.isspace() for c in deployment_id):
+            raise ValueError(f"Invalid deployment id: {deployment_id!r}")
+
+        line = f"{deployment_id}\t{downloads}\t{'' if rating is None else rating}\n"
+        shard = self._shards[hash(deployment_id) % len(self._shards)]
+        with shard.lock:
+            shard.log.write(line)
+            shard.log.flush()
+            delta = shard.deltas.get(deployment_id)
+            if delta is None:
+                delta = shard.deltas[deployment_id] = Delta()
+            delta.downloads += downloads
+            if rating is not None:
+                delta.rating_sum += rating
+                delta.ratings += 1
+
+    def record_download(self, deployment_id: str) -> None:
+        self._record(deployment_id, 1, None)
+
+    def record_rating(self, deployment_id: str, rating: float) -> None:
+        if not MIN_RATING <= rating <= MAX_RATING:
+            raise ValueError(f"Rating must be between {MIN_RATING} and {MAX_RATING}")
+        self._record(deployment_id, 0, rating)
+
+    def flush(self) -> dict[str, int]:
+        """Write all counts recorded so far to the database."""
+        with self._flush_lock:
+            deltas, self._carry = self._carry, {}
+            segments, self._pending_segments = self._pending_segments, []
+            for shard in self._shards:
+                with shard.lock:
+                    swapped, shard.deltas = shard.deltas, {}
+                    if swapped:
+                        segments.append(shard.rotate())
+                _merge(deltas, swapped)
+
+            if not deltas:
+                self._pending_segments = segments
+                return {"apps": 0, "unknown_deployments": 0}
+
+            try:
+                apps, unknown = _apply_deltas(deltas)
+            except Exception as e:
+                # Keep everything for the next flush; the segments stay on disk
+                self._carry = deltas
+                self._pending_segments = segments
+                self.last_error = str(e)
+                raise
+
+            for segment in segments:
+                segment.unlink(missing_ok=True)
+            self.flushes += 1
+            self.last_flush_at = time.time()
+            self.last_error = None
+
+        if unknown:
+            logger.warning(f"Dropped counts for {unknown} unknown deployments")
+        return {"apps": apps, "unknown_deployments": unknown}
+
+    def stats(self) -> dict[str, Any]:
+        pending = set(self._carry)
+        for shard in self._shards:
+            with shard.lock:
+                pending.update(shard.deltas)
+        return {
+            "pending_deployments": len(pending),
+            "pending_segments": len(self._pending_segments),
+            "flushes": self.flushes,
+            "last_flush_at": self.last_flush_at,
+            "last_error": self.last_error,
+        }
+
+    def close(self) -> None:
+        for shard in self._shards:
+            with shard.lock:
+                shard.log.close()
+        os.close(self._lock_fd)
+
+
+async def run_flusher(
+    counters: WriteBehindCounters, interval: float = COUNTER_FLUSH_INTERVAL_SECONDS
+) -> None:
+    """Flush counters every `interval` seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(counters.flush)
+        except Exception as e:
+            logger.error(f"Counter flush failed: {e}")
+
+
+_counters: Optional[WriteBehindCounters] = None
+_counters_lock = threading.Lock()
+
+
+def get_counters() -> WriteBehindCounters:
+    """The process-wide counters, created (and recovered) on first use."""
+    global _counters
+    with _counters_lock:
+        if _counters is None:
+            _counters = WriteBehindCounters()
+        return _counters
@@ -0,0 +1,365 @@
+"""Versioned deployment history, rollback and storage garbage collection.
+
+Every build of an app is recorded as an AppVersion. Its App.jsx is stored as
+a zlib-compressed line delta against the parent version, with a full snapshot
+every SNAPSHOT_INTERVAL versions along a chain so reconstruction stays cheap.
+
+Rolling back re-points MiniApp.deployment_id at an earlier build. Builds that
+are neither current nor among the newest KEEP_BUILDS_PER_APP versions have
+their storage objects deleted by the GC job; rolling back to one of those
+rebuilds it from the stored source.
+"""
+
+import asyncio
+import difflib
+import hashlib
+import json
+import os
+import threading
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+from sqlalchemy import func, orm
+from sqlalchemy.orm import load_only
+from sqlalchemy.exc import SQLAlchemyError
+
+from log import logger
+from src.js_bundle_upload.main import build_app_local
+from src.models import AppVersion, MiniApp
+from src.storage import StorageBackend, storage
+from src.supabase import Session
+
+SNAPSHOT_INTERVAL = int(os.getenv("VERSION_SNAPSHOT_INTERVAL", "10"))
+KEEP_BUILDS_PER_APP = int(os.getenv("KEEP_BUILDS_PER_APP", "5"))
+GC_INTERVAL_SECONDS = float(os.getenv("DEPLOYMENT_GC_INTERVAL_SECONDS", "3600"))
+GC_BATCH_SIZE = int(os.getenv("DEPLOYMENT_GC_BATCH_SIZE", "100"))
+GC_MAX_DEPLOYMENTS = int(os.getenv("DEPLOYMENT_GC_MAX_DEPLOYMENTS", "500"))
+# Builds are uploaded before their row is committed, so young orphans are kept
+GC_MIN_AGE_SECONDS = float(os.getenv("DEPLOYMENT_GC_MIN_AGE_SECONDS", "3600"))
+
+DEPLOYMENTS_PREFIX = "deployments"
+
+# The periodic job and the admin endpoint must not prune the same builds
+_gc_lock = threading.Lock()
+
+
+def encode_delta(parent_text: str, text: str) -> bytes:
+    """Encode text as line copies from parent_text plus inserted lines."""
+    parent_lines = parent_text.splitlines(keepends=True)
+    lines = text.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, parent_lines, lines, autojunk=False)
+
+    ops = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append(["=", i1, i2])
+        elif tag in ("replace", "insert"):
+            ops.append(["+", "".join(lines[j1:j2])])
+    return zlib.compress(json.dumps(ops, separators=(",", ":")).encode(), 9)
+
+
+def apply_delta(parent_text: str, payload: bytes) -> str:
+    parent_lines = parent_text.splitlines(keepends=True)
+    parts = []
+    for op in json.loads(zlib.decompress(payload)):
+        if op[0] == "=":
+            parts.extend(parent_lines[op[1] : op[2]])
+        else:
+            parts.append(op[1])
+    return "".join(parts)
+
+
+def _content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _reconstruct(version: AppVersion) -> tuple[str, int]:
+    """Return the version's source and its distance from the nearest snapshot."""
+    chain = []
+    while not version.is_snapshot:
+        chain.append(version)
+        version = version.parent
+
+    text = zlib.decompress(version.payload).decode()
+    for delta in reversed(chain):
+        text = apply_delta(text, delta.payload)
+    return text, len(chain)
+
+
+def reconstruct(version: AppVersion) -> str:
+    """Return the App.jsx source of a version."""
+    text, _ = _reconstruct(version)
+    if _content_hash(text) != version.content_hash:
+        raise ValueError(f"Version {version.id} failed its integrity check")
+    return text
+
+
+def new_version(
+    app: MiniApp,
+    deployment_id: str,
+    app_jsx: str,
+    parent: Optional[AppVersion] = None,
+    number: int = 1,
+) -> AppVersion:
+    """Create the AppVersion for a build of app, attached to app.versions."""
+    snapshot = zlib.compress(app_jsx.encode(), 9)
+    payload, is_snapshot = snapshot, True
+
+    if parent is not None:
+        parent_text, depth = _reconstruct(parent)
+        if depth + 1 < SNAPSHOT_INTERVAL:
+            delta = encode_delta(parent_text, app_jsx)
+            if len(delta) < len(snapshot):
+                payload, is_snapshot = delta, False
+
+    return AppVersion(
+        app=app,
+        parent=parent,
+        number=number,
+        deployment_id=deployment_id,
+        is_snapshot=is_snapshot,
+        payload=payload,
+        content_hash=_content_hash(app_jsx),
+    )
+
+
+def record_version(
+    session: orm.Session,
+    app: MiniApp,
+    deployment_id: str,
+    app_jsx: str,
+    parent: Optional[AppVersion] = None,
+) -> AppVersion:
+    """Add a new version of a persisted app to its session (not committed).
+
+    The parent defaults to the version of the app's current deployment. The
+    app row stays locked until the session commits, so concurrent edits and
+    rollbacks of one app are numbered one after the other.
+    """
+    current_deployment_id = (
+        session.query(MiniApp.deployment_id)
+        .filter(MiniApp.id == app.id)
+        .with_for_update()
+        .scalar()
+    )
+    if parent is None:
+        parent = (
+            session.query(AppVersion)
+            .filter(AppVersion.deployment_id == current_deployment_id)
+            .first()
+        )
+    latest = (
+        session.query(func.max(AppVersion.number))
+        .filter(AppVersion.app_id == app.id)
+        .scalar()
+    )
+    version = new_version(app, deployment_id, app_jsx, parent, (latest or 0) + 1)
+    session.add(version)
+    return version
+
+
+def list_versions(deployment_id: str) -> Optional[list[dict[str, Any]]]:
+    """List the versions of the app currently deployed at deployment_id."""
+    with Session() as session:
+        app = (
+            session.query(MiniApp)
+            .filter(MiniApp.deployment_id == deployment_id)
+            .first()
+        )
+        if app is None:
+            return None
+        versions = (
+            session.query(AppVersion)
+            .options(
+                load_only(
+                    AppVersion.id,
+                    AppVersion.parent_id,
+                    AppVersion.number,
+                    AppVersion.deployment_id,
+                    AppVersion.build_pruned,
+                    AppVersion.created_at,
+                )
+            )
+            .filter(AppVersion.app_id == app.id)
+            .order_by(AppVersion.number)
+            .all()
+        )
+        numbers = {version.id: version.number for version in versions}
+        return [
+            {
+                "version": version.number,
+                "deployment_id": version.deployment_id,
+                "parent_version": numbers.get(version.parent_id),
+                "created_at": version.created_at.isoformat(),
+                "current": version.deployment_id == app.deployment_id,
+                "build_available": not version.build_pruned,
+            }
+            for version in versions
+        ]
+
+
+def _find_version(
+    session: orm.Session, deployment_id: str, version_number: int
+) -> tuple[Optional[MiniApp], Optional[AppVersion]]:
+    app = session.query(MiniApp).filter(MiniApp.deployment_id == deployment_id).first()
+    if app is None:
+        return None, None
+    target = (
+        session.query(AppVersion)
+        .filter(AppVersion.app_id == app.id, AppVersion.number == version_number)
+        .first()
+    )
+    return app, target
+
+
+def rollback_app(deployment_id: str, version_number: int) -> Optional[str]:
+    """Point the app deployed at deployment_id back at one of its versions.
+
+    Returns:
+        The deployment id now serving the app, or None if the app or version
+        does not exist.
+    """
+    rebuilt = None
+    with Session() as session:
+        app, target = _find_version(session, deployment_id, version_number)
+        if target is None:
+            return None
+        if target.build_pruned:
+            # The build was garbage collected; rebuild it from the stored source.
+            # The build runs outside any transaction.
+            app_jsx = reconstruct(target)
+            logger.info(f"Rebuilding pruned version {version_number} of app {app.id}")
+            rebuilt = (build_app_local(app_jsx)["buildId"], app_jsx)
+
+    with Session() as session:
+        try:
+            app, target = _find_version(session, deployment_id, version_number)
+            if target is None:
+                return None
+            if rebuilt is not None:
+                target = record_version(session, app, *rebuilt, target)
+
+            app.deployment_id = target.deployment_id
+            session.commit()
+            logger.info(
+                f"Rolled back app {app.id} to version {version_number} "
+                f"({app.deployment_id})"
+            )
+            return app.deployment_id
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Rollback failed: {str(e)}")
+            raise
+
+
+def _delete_deployment(
+    backend: StorageBackend, deployment_id: str, files: Optional[list] = None
+) -> None:
+    prefix = f"{DEPLOYMENTS_PREFIX}/{deployment_id}"
+    if files is None:
+        files = backend.list_dir(prefix)
+    paths = [f"{prefix}/{entry.name}" for entry in files]
+    for start in range(0, len(paths), GC_BATCH_SIZE):
+        backend.delete(paths[start : start + GC_BATCH_SIZE])
+
+
+def _prune_old_builds(session: orm.Session, backend: StorageBackend, limit: int) -> int:
+    """Delete the builds of versions outside the per-app retention window."""
+    current = {
+        deployment_id for (deployment_id,) in session.query(MiniApp.deployment_id)
+    }
+    versions = (
+        session.query(AppVersion)
+        .options(
+            load_only(
+                AppVersion.id,
+                AppVersion.app_id,
+                AppVersion.number,
+                AppVersion.deployment_id,
+            )
+        )
+        .filter(AppVersion.build_pruned.is_(False))
+        .order_by(AppVersion.app_id, AppVersion.number.desc())
+        .all()
+    )
+
+    pruned = 0
+    kept_per_app: dict[int, int] = {}
+    for version in versions:
+        kept = kept_per_app.get(version.app_id, 0)
+        if version.deployment_id in current or kept < KEEP_BUILDS_PER_APP:
+            kept_per_app[version.app_id] = kept + 1
+            continue
+        if pruned >= limit:
+            break
+
+        _delete_deployment(backend, version.deployment_id)
+        version.build_pruned = True
+        pruned += 1
+        if pruned % GC_BATCH_SIZE == 0:
+            session.commit()
+
+    session.commit()
+    return pruned
+
+
+def _sweep_orphans(session: orm.Session, backend: StorageBackend, limit: int) -> int:
+    """Delete deployment folders that no app or version refers to."""
+    referenced = {
+        deployment_id for (deployment_id,) in session.query(MiniApp.deployment_id)
+    }
+    referenced.update(
+        deployment_id
+        for (deployment_id,) in session.query(AppVersion.deployment_id).filter(
+            AppVersion.build_pruned.is_(False)
+        )
+    )
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=GC_MIN_AGE_SECONDS)
+
+    swept = 0
+    for folder in backend.list_dir(DEPLOYMENTS_PREFIX):
+        if swept >= limit:
+            break
+        if folder.name in referenced:
+            continue
+
+        files = backend.list_dir(f"{DEPLOYMENTS_PREFIX}/{folder.name}")
+        timestamps = [f.created_at for f in files if f.created_at is not None]
+        if not timestamps or max(timestamps) > cutoff:
+            continue
+
+        _delete_deployment(backend, folder.name, files)
+        swept += 1
+    return swept
+
+
+def collect_garbage(
+    backend: StorageBackend = storage, limit: int = GC_MAX_DEPLOYMENTS
+) -> dict[str, int]:
+    """Delete unreferenced deployment storage, at most `limit` deployments per phase."""
+    with _gc_lock, Session() as session:
+        try:
+            pruned = _prune_old_builds(session, backend, limit)
+            swept = _sweep_orphans(session, backend, limit)
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Deployment GC failed: {str(e)}")
+            raise
+
+    logger.info(f"🧹 Deployment GC pruned {pruned} old builds, swept {swept} orphans")
+    return {"pruned_builds": pruned, "swept_orphans": swept}
+
+
+async def run_garbage_collector(interval: float = GC_INTERVAL_SECONDS) -> None:
+    """Run collect_garbage every `interval` seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(collect_garbage)
+        except Exception as e:
+            logger.error(f"Deployment GC run failed: {e}")
+
+
+if __name__ == "__main__":
+    print(collect_garbage())
@@ -0,0 +1,229 @@
+// Persistent fast-path bundler for template-web-app.
+//
+// The template shell (React, react-dom and main.jsx's mount logic) is bundled
+// once at startup. Each request then only bundles the generated App.jsx
+// through an incremental esbuild context, compiles the Tailwind classes it
+// uses, and splices both into the template index.html.
+//
+// useStore and the bridge stay out of the shell: like in the Vite build they
+// are bundled with App.jsx only when it imports them, since loading useStore
+// calls linkBridge.
+//
+// Protocol: one JSON object per line.
+//   stdin:  {"id": 1, "app_jsx": "..."}
+//   stdout: {"ready": true} once, then {"id": 1, "html": "..."} or {"id": 1, "error": "..."}
+//
+// Usage: node fast_bundler.mjs <template-web-app dir>
+
+import fs from "node:fs";
+import path from "node:path";
+import readline from "node:readline";
+import { createRequire } from "node:module";
+
+const templateDir = path.resolve(process.argv[2]);
+const srcDir = path.join(templateDir, "src");
+const require = createRequire(path.join(templateDir, "package.json"));
+const esbuild = require("esbuild");
+const { compile, optimize } = require("@tailwindcss/node");
+const { Scanner } = require("@tailwindcss/oxide");
+
+// Modules provided by the prebuilt shell: import specifier -> module it maps to
+const SHELL_MODULES = {
+  react: "react",
+  "react/jsx-runtime": "react/jsx-runtime",
+  "react-dom": "react-dom",
+  "react-dom/client": "react-dom/client",
+};
+const SHELL_SPECIFIER = /^(react|react\/jsx-runtime|react-dom|react-dom\/client)$/;
+
+const BUILD_OPTIONS = {
+  bundle: true,
+  write: false,
+  format: "iife",
+  minify: true,
+  target: "es2020",
+  jsx: "automatic",
+  define: { "process.env.NODE_ENV": '"production"' },
+  logLevel: "silent",
+};
+
+function send(message) {
+  process.stdout.write(JSON.stringify(message) + "\n");
+}
+
+function escapeInline(code, tag) {
+  return code.replace(new RegExp(`</${tag}`, "gi"), `<\\/${tag}`);
+}
+
+async function buildShell() {
+  const imports = Object.entries(SHELL_MODULES).map(([specifier, from], index) => ({
+    specifier,
+    name: `m${index}`,
+    line: `import * as m${index} from ${JSON.stringify(from)};`,
+  }));
+
+  const contents = [
+    ...imports.map((entry) => entry.line),
+    'import { StrictMode, createElement } from "react";',
+    'import { createRoot } from "react-dom/client";',
+    "window.__microapp = {",
+    `  modules: { ${imports.map((e) => `${JSON.stringify(e.specifier)}: ${e.name}`).join(", ")} },`,
+    "  mount(App) {",
+    '    createRoot(document.getElementById("root")).render(',
+    "      createElement(StrictMode, null, createElement(App))",
+    "    );",
+    "  },",
+    "};",
+  ].join("\n");
+
+  const result = await esbuild.build({
+    ...BUILD_OPTIONS,
+    stdin: { contents, resolveDir: templateDir, loader: "js" },
+  });
+  return result.outputFiles[0].text;
+}
+
+async function loadTailwind() {
+  const css = fs.readFileSync(path.join(srcDir, "index.css"), "utf8");
+  const compiler = await compile(css, { base: srcDir, onDependency() {} });
+
+  // Same source detection as @tailwindcss/vite, minus the generated App.jsx:
+  // root is "none" for source(none), null for automatic detection from the
+  // Vite root, or the { base, pattern } given to source(...)
+  let rootSources = [];
+  if (compiler.root === null) {
+    rootSources = [{ base: templateDir, pattern: "**/*", negated: false }];
+  } else if (compiler.root !== "none") {
+    rootSources = [{ ...compiler.root, negated: false }];
+  }
+  const sources = [
+    ...rootSources,
+    ...compiler.sources,
+    { base: srcDir, pattern: "App.jsx", negated: true },
+  ];
+  const shellCandidates = new Scanner({ sources }).scan();
+  return { css, shellCandidates };
+}
+
+async function buildCss(tailwind, appJsx, appCss) {
+  // A fresh compiler per request: build() accumulates candidates across calls
+  const compiler = await compile(tailwind.css, { base: srcDir, onDependency() {} });
+  const appCandidates = new Scanner({ sources: [] }).scanFiles([
+    { content: appJsx, extension: "jsx" },
+  ]);
+  const generated = compiler.build([...tailwind.shellCandidates, ...appCandidates]);
+  const optimized = optimize(generated + appCss, { minify: true });
+  return typeof optimized === "string" ? optimized : optimized.code;
+}
+
+function appPlugin(state) {
+  return {
+    name: "microapp",
+    setup(build) {
+      build.onResolve({ filter: /^microapp:entry$/ }, () => ({
+        path: "entry",
+        namespace: "microapp",
+      }));
+      build.onLoad({ filter: /.*/, namespace: "microapp" }, () => ({
+        contents: 'import App from "./src/App.jsx";\nwindow.__microapp.mount(App);',
+        resolveDir: templateDir,
+        loader: "js",
+      }));
+
+      build.onResolve({ filter: /^\.\/src\/App\.jsx$/, namespace: "microapp" }, () => ({
+        path: path.join(srcDir, "App.jsx"),
+        namespace: "microapp-app",
+      }));
+      build.onLoad({ filter: /.*/, namespace: "microapp-app" }, () => ({
+        contents: state.appJsx,
+        resolveDir: srcDir,
+        loader: "jsx",
+      }));
+
+      // Also matches the React imports of src/useStore.ts, so it shares the
+      // shell's React instance
+      build.onResolve({ filter: SHELL_SPECIFIER }, (args) => ({
+        path: args.path,
+        namespace: "microapp-shell",
+      }));
+      build.onLoad({ filter: /.*/, namespace: "microapp-shell" }, (args) => ({
+        contents: `module.exports = window.__microapp.modules[${JSON.stringify(args.path)}];`,
+        loader: "js",
+      }));
+
+      // Tailwind is compiled separately; the entry stylesheet is not bundled
+      build.onResolve({ filter: /index\.css$/ }, () => ({
+        path: "index.css",
+        namespace: "microapp-empty",
+      }));
+      build.onLoad({ filter: /.*/, namespace: "microapp-empty" }, () => ({
+        contents: "",
+        loader: "css",
+      }));
+    },
+  };
+}
+
+function splitHtml() {
+  const html = fs.readFileSync(path.join(templateDir, "index.html"), "utf8");
+  const withoutEntry = html.replace(/\s*<script type="module" src="\/src\/main\.jsx"><\/script>/, "");
+  const headEnd = withoutEntry.indexOf("</head>");
+  return [withoutEntry.slice(0, headEnd), withoutEntry.slice(headEnd)];
+}
+
+async function main() {
+  const state = { appJsx: "" };
+  const [shellJs, tailwind] = await Promise.all([buildShell(), loadTailwind()]);
+  const [htmlHead, htmlTail] = splitHtml();
+  const context = await esbuild.context({
+    ...BUILD_OPTIONS,
+    entryPoints: ["microapp:entry"],
+    outdir: path.join(templateDir, "dist"),
+    plugins: [appPlugin(state)],
+  });
+
+  async function handle(request) {
+    state.appJsx = request.app_jsx;
+    const result = await context.rebuild();
+    const appJs = result.outputFiles.find((file) => file.path.endsWith(".js")).text;
+    const appCss = result.outputFiles
+      .filter((file) => file.path.endsWith(".css"))
+      .map((file) => file.text)
+      .join("\n");
+    const css = await buildCss(tailwind, request.app_jsx, appCss);
+
+    return (
+      htmlHead +
+      `  <script type="module" crossorigin>${escapeInline(shellJs + appJs, "script")}</script>\n` +
+      `    <style rel="stylesheet" crossorigin>${escapeInline(css, "style")}</style>\n  ` +
+      htmlTail
+    );
+  }
+
+  // Requests are handled one at a time since they share the esbuild context
+  let queue = Promise.resolve();
+  const lines = readline.createInterface({ input: process.stdin });
+  lines.on("line", (line) => {
+    queue = queue.then(async () => {
+      let request;
+      try {
+        request = JSON.parse(line);
+        send({ id: request.id, html: await handle(request) });
+      } catch (error) {
+        send({ id: request && request.id, error: String(error && error.message ? error.message : error) });
+      }
+    });
+  });
+  lines.on("close", async () => {
+    await queue;
+    await context.dispose();
+    process.exit(0);
+  });
+
+  send({ ready: true });
+}
+
+main().catch((error) => {
+  send({ error: String(error && error.stack ? error.stack : error) });
+  process.exit(1);
+});
@@ -0,0 +1,123 @@
+import json
+import re
+import select
+import subprocess
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from log import logger
+
+WORKER_SCRIPT = Path(__file__).parent / "fast_bundler.mjs"
+
+
+class FastBundler:
+    """Persistent node worker that builds App.jsx without running Vite.
+
+    The worker prebuilds the template shell once, then for every request
+    bundles only App.jsx with an incremental esbuild context, generates the
+    Tailwind classes it uses and splices both into the template index.html.
+    """
+
+    def __init__(
+        self,
+        template_app_dir: Path,
+        startup_timeout: float = 60.0,
+        request_timeout: float = 30.0,
+    ):
+        self.template_app_dir = template_app_dir
+        self.startup_timeout = startup_timeout
+        self.request_timeout = request_timeout
+        self._process: Optional[subprocess.Popen] = None
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _read_message(self, timeout: float) -> Dict[str, Any]:
+        ready, _, _ = select.select([self._process.stdout], [], [], timeout)
+        if not ready:
+            raise TimeoutError("Fast-path bundler did not respond in time")
+
+        line = self._process.stdout.readline()
+        if not line:
+            raise RuntimeError("Fast-path bundler exited unexpectedly")
+        return json.loads(line)
+
+    def _start(self) -> None:
+        logger.info("⚡ Starting fast-path bundler worker...")
+        self._process = subprocess.Popen(
+            ["node", str(WORKER_SCRIPT), str(self.template_app_dir)],
+            cwd=self.template_app_dir,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+        message = self._read_message(self.startup_timeout)
+        if not message.get("ready"):
+            raise RuntimeError(
+                f"Fast-path bundler failed to start: {message.get('error')}"
+            )
+        logger.info("⚡ Fast-path bundler ready")
+
+    def close(self) -> None:
+        if self._process and self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+        self._process = None
+
+    def bundle(self, app_jsx_content: str) -> str:
+        """Return the single-file index.html for the given App.jsx"""
+        with self._lock:
+            try:
+                if self._process is None or self._process.poll() is not None:
+                    self._start()
+
+                self._next_id += 1
+                request = {"id": self._next_id, "app_jsx": app_jsx_content}
+                self._process.stdin.write(json.dumps(request) + "\n")
+                self._process.stdin.flush()
+
+                response = self._read_message(self.request_timeout)
+            except Exception:
+                # A worker in an unknown state is restarted on the next call
+                self.close()
+                raise
+
+        if response.get("id") != request["id"]:
+            self.close()
+            raise RuntimeError("Fast-path bundler returned a mismatched response")
+        if "error" in response:
+            raise RuntimeError(f"Fast-path build failed: {response['error']}")
+        return response["html"]
+
+
+def _css_selectors(html: str) -> set:
+    styles = "".join(re.findall(r"<style[^>]*>(.*?)</style>", html, re.S))
+    return set(re.findall(r"\.((?:\\.|[\w-])+)", styles))
+
+
+def compare_builds(vite_html: str, fast_html: str) -> Dict[str, Any]:
+    """Compare a Vite build with a fast-path build of the same App.jsx"""
+    vite_selectors = _css_selectors(vite_html)
+    fast_selectors = _css_selectors(fast_html)
+    title = re.compile(r"<title>(.*?)</title>", re.S)
+
+    report = {
+        "same_title": title.findall(vite_html) == title.findall(fast_html),
+        "has_root": '<div id="root"></div>' in fast_html,
+        "inline_scripts": (
+            vite_html.count("<script"),
+            fast_html.count("<script"),
+        ),
+        "missing_selectors": sorted(vite_selectors - fast_selectors),
+        "extra_selectors": sorted(fast_selectors - vite_selectors),
+        "sizes": (len(vite_html), len(fast_html)),
+    }
+    report["equivalent"] = (
+        report["same_title"]
+        and report["has_root"]
+        and report["inline_scripts"][0] == report["inline_scripts"][1]
+        and not report["missing_selectors"]
+        and not report["extra_selectors"]
+    )
+    return report
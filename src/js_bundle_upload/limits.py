@@ -0,0 +1,182 @@
+import os
+import resource
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from log import logger
+
+KILL_GRACE_SECONDS = 5.0
+# Holds the child until the parent has applied its limits, then execs the
+# command in the same process (so the limits and the pid carry over)
+GATE = ["sh", "-c", 'read -r _ || exit 125; exec "$@"', "build"]
+POLL_INTERVAL_SECONDS = 0.05
+
+
+@dataclass
+class BuildLimits:
+    """Resource limits for build subprocesses
+
+    Memory and CPU are enforced with a cgroup v2 child of ``cgroup_root`` when
+    that directory is set and writable, otherwise with rlimits on the child
+    (RLIMIT_DATA for memory, RLIMIT_CPU for CPU seconds).
+    """
+
+    install_timeout: float = float(os.getenv("INSTALL_TIMEOUT_SECONDS", "600"))
+    build_timeout: float = float(os.getenv("BUILD_TIMEOUT_SECONDS", "300"))
+    memory_mb: int = int(os.getenv("BUILD_MEMORY_LIMIT_MB", "2048"))
+    cpu_seconds: int = int(os.getenv("BUILD_CPU_SECONDS", "600"))
+    cpu_cores: float = float(os.getenv("BUILD_CPU_CORES", "1"))
+    cgroup_root: Optional[str] = os.getenv("BUILD_CGROUP_ROOT")
+
+
+class _BuildCgroup:
+    """A throwaway cgroup v2 for one build"""
+
+    CPU_PERIOD_US = 100_000
+
+    def __init__(self, root: Path, limits: BuildLimits):
+        self.path = root / f"build-{uuid.uuid4().hex[:12]}"
+        self.path.mkdir()
+        (self.path / "memory.max").write_text(str(limits.memory_mb * 1024 * 1024))
+        quota = int(limits.cpu_cores * self.CPU_PERIOD_US)
+        (self.path / "cpu.max").write_text(f"{quota} {self.CPU_PERIOD_US}")
+
+    def peak_memory_kb(self) -> Optional[int]:
+        peak = self.path / "memory.peak"
+        return int(peak.read_text()) // 1024 if peak.exists() else None
+
+    def remove(self) -> None:
+        try:
+            self.path.rmdir()
+        except OSError as e:
+            logger.warning(f"⚠️ Could not remove build cgroup {self.path}: {e}")
+
+
+def _open_cgroup(limits: BuildLimits) -> Optional[_BuildCgroup]:
+    if not limits.cgroup_root:
+        return None
+    root = Path(limits.cgroup_root)
+    if not (root / "cgroup.procs").exists() or not os.access(root, os.W_OK):
+        return None
+    try:
+        return _BuildCgroup(root, limits)
+    except OSError as e:
+        logger.warning(f"⚠️ cgroup limits unavailable, using rlimits: {e}")
+        return None
+
+
+def _apply_limits(
+    pid: int, limits: BuildLimits, cgroup: Optional[_BuildCgroup]
+) -> None:
+    """Put an already started child under the memory and CPU caps"""
+    if cgroup is not None:
+        (cgroup.path / "cgroup.procs").write_text(str(pid))
+        return
+    memory = limits.memory_mb * 1024 * 1024
+    resource.prlimit(pid, resource.RLIMIT_DATA, (memory, memory))
+    resource.prlimit(
+        pid, resource.RLIMIT_CPU, (limits.cpu_seconds, limits.cpu_seconds + 5)
+    )
+
+
+def _kill_group(pgid: int, sig: int) -> None:
+    try:
+        os.killpg(pgid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _wait(pid: int, pgid: int, timeout: float):
+    """Wait for pid, killing its process group if it outlives the timeout"""
+    deadline = time.monotonic() + timeout
+    escalation: Optional[threading.Timer] = None
+    while True:
+        reaped, status, rusage = os.wait4(pid, os.WNOHANG)
+        if reaped:
+            if escalation is not None:
+                escalation.cancel()
+            return status, rusage, escalation is not None
+        if escalation is None and time.monotonic() >= deadline:
+            logger.warning(f"⏱️ Build command exceeded {timeout}s, killing it")
+            _kill_group(pgid, signal.SIGTERM)
+            escalation = threading.Timer(
+                KILL_GRACE_SECONDS, _kill_group, (pgid, signal.SIGKILL)
+            )
+            escalation.start()
+        time.sleep(POLL_INTERVAL_SECONDS)
+
+
+def run_limited(
+    command: List[str],
+    cwd: Path,
+    timeout: float,
+    limits: BuildLimits,
+    env: Optional[Dict[str, str]] = None,
+) -> tuple[subprocess.CompletedProcess, Dict[str, Any]]:
+    """Run a command in its own process group under a wall-clock timeout and
+    memory/CPU caps
+
+    Returns:
+        The completed process and its resource usage
+    """
+    cgroup = _open_cgroup(limits)
+    start = time.monotonic()
+    try:
+        # Limits are applied from the parent: a preexec_fn is not safe in a
+        # threaded process and must not do file I/O between fork and exec
+        process = subprocess.Popen(
+            GATE + command,
+            cwd=cwd,
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            start_new_session=True,
+        )
+        try:
+            _apply_limits(process.pid, limits, cgroup)
+        except OSError:
+            _kill_group(process.pid, signal.SIGKILL)
+            process.communicate()
+            raise
+        process.stdin.write("\n")
+        process.stdin.close()
+        with ThreadPoolExecutor(max_workers=2) as readers:
+            stdout = readers.submit(process.stdout.read)
+            stderr = readers.submit(process.stderr.read)
+            status, rusage, timed_out = _wait(process.pid, process.pid, timeout)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            # Take down anything the command left running so the pipes close
+            _kill_group(process.pid, signal.SIGKILL)
+            result = subprocess.CompletedProcess(
+                command, process.returncode, stdout.result(), stderr.result()
+            )
+        process.stdout.close()
+        process.stderr.close()
+
+        peak_rss_kb = rusage.ru_maxrss
+        if cgroup is not None:
+            peak_rss_kb = cgroup.peak_memory_kb() or peak_rss_kb
+    finally:
+        if cgroup is not None:
+            cgroup.remove()
+
+    usage = {
+        "command": " ".join(command),
+        "returncode": result.returncode,
+        "timed_out": timed_out,
+        "wall_seconds": round(time.monotonic() - start, 3),
+        "user_cpu_seconds": round(rusage.ru_utime, 3),
+        "system_cpu_seconds": round(rusage.ru_stime, 3),
+        "peak_rss_kb": peak_rss_kb,
+        "limits": "cgroup" if cgroup is not None else "rlimit",
+    }
+    return result, usage
@@ -9,11 +9,25 @@ from pathlib import Path
 from typing import Any, Dict, List, Optional
 
 from log import logger
-from src.supabase import supabase
+from src.compression import VARIANT_SUFFIXES, compress_variants
+from src.profiling import record_subprocess, span
+from src.storage import storage
+
+from src.js_bundle_upload.fast_path import FastBundler, compare_builds
+from src.js_bundle_upload.limits import BuildLimits, run_limited
+
+TEMPLATE_APP_DIR = (Path(__file__).parent.parent.parent / "template-web-app").resolve()
+FAST_PATH_BUILDS = os.getenv("FAST_PATH_BUILDS", "0") == "1"
+
+# One persistent fast-path worker per process, started on first use
+fast_bundler = FastBundler(TEMPLATE_APP_DIR)
 
 
 class BuildService:
-    def __init__(self):
+    def __init__(self, limits: Optional[BuildLimits] = None):
+        self.limits = limits or BuildLimits()
+        # Resource usage of every subprocess run by this service
+        self.resource_usage: List[Dict[str, Any]] = []
         self.mime_types = {
             ".html": "text/html",
             ".js": "application/javascript",
@@ -31,10 +45,36 @@ class BuildService:
             ".map": "application/json",
         }
 
+    def prepare_shared_workspace(
+        self, template_app_dir: Path = TEMPLATE_APP_DIR
+    ) -> Path:
+        """Copy template-app once and install its dependencies for reuse across builds"""
+        temp_dir = Path(tempfile.mkdtemp(prefix="expo_workspace_"))
+        workspace_dir = temp_dir / "app"
+
+        logger.info(f"📋 Creating shared build workspace: {workspace_dir}")
+
+        try:
+            shutil.copytree(
+                template_app_dir, workspace_dir, ignore=shutil.ignore_patterns("dist")
+            )
+            self.run_npm_install(workspace_dir)
+            return workspace_dir
+        except Exception as e:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise e
+
     def copy_template_with_custom_index(
-        self, template_app_dir: Path, app_jsx_content: str
+        self,
+        template_app_dir: Path,
+        app_jsx_content: str,
+        workspace_dir: Optional[Path] = None,
     ) -> Path:
-        """Copy template-app to a temporary directory and replace index.jsx"""
+        """Copy template-app to a temporary directory and replace index.jsx
+
+        When a shared workspace is given, its sources are copied and its
+        node_modules are symlinked instead of being copied or reinstalled.
+        """
         # Create a temporary directory
         temp_dir = Path(tempfile.mkdtemp(prefix="expo_build_"))
         temp_app_dir = temp_dir / "app"
@@ -42,9 +82,20 @@ class BuildService:
         logger.info(f"📋 Creating temporary build directory: {temp_app_dir}")
 
         try:
-            # Copy the entire template-app directory
-            shutil.copytree(template_app_dir, temp_app_dir)
-            logger.info("📁 Template app copied successfully")
+            if workspace_dir:
+                shutil.copytree(
+                    workspace_dir,
+                    temp_app_dir,
+                    ignore=shutil.ignore_patterns("node_modules", "dist"),
+                )
+                (temp_app_dir / "node_modules").symlink_to(
+                    workspace_dir / "node_modules", target_is_directory=True
+                )
+                logger.info("📁 Shared workspace linked successfully")
+            else:
+                # Copy the entire template-app directory
+                shutil.copytree(template_app_dir, temp_app_dir)
+                logger.info("📁 Template app copied successfully")
 
             # Write the custom index.jsx content as App.jsx
             app_file_path = temp_app_dir / "src" / "App.jsx"
@@ -84,7 +135,44 @@ class BuildService:
         _get_files_recursive(dir_path)
         return all_files
 
-    def run_html_export(self, template_app_dir: Path) -> None:
+    def run_command(
+        self,
+        command: List[str],
+        cwd: Path,
+        timeout: float,
+        env: Optional[Dict[str, str]] = None,
+    ) -> subprocess.CompletedProcess:
+        """Run a command under the build limits, recording its resource usage
+
+        Raises:
+            TimeoutError: If the command was killed for exceeding the timeout
+        """
+        result, usage = run_limited(command, cwd, timeout, self.limits, env)
+        self.resource_usage.append(usage)
+        record_subprocess(
+            command, usage["wall_seconds"], result.returncode, usage["peak_rss_kb"]
+        )
+        if usage["timed_out"]:
+            raise TimeoutError(f"{' '.join(command)} timed out after {timeout}s")
+        return result
+
+    def run_npm_install(self, template_app_dir: Path) -> None:
+        """Run npm install to ensure dependencies are installed"""
+        logger.info("   Running: npm install")
+        with span("npm install"):
+            install_result = self.run_command(
+                ["npm", "install"], template_app_dir, self.limits.install_timeout
+            )
+
+        if install_result.returncode != 0:
+            error_msg = (
+                install_result.stderr if install_result.stderr else "npm install failed"
+            )
+            logger.warning(f"   ⚠️ npm install warning: {error_msg}")
+        else:
+            logger.info("   ✅ npm install completed")
+
+    def run_html_export(self, template_app_dir: Path, install: bool = True) -> None:
         """Run npm build command"""
         logger.info("📦 Building HTML app...")
 
@@ -92,21 +180,8 @@ class BuildService:
             raise FileNotFoundError("template-app directory not found!")
 
         try:
-            # First run npm install to ensure dependencies are installed
-            logger.info("   Running: npm install")
-            install_result = subprocess.run(
-                ["npm", "install"], cwd=template_app_dir, capture_output=True, text=True
-            )
-
-            if install_result.returncode != 0:
-                error_msg = (
-                    install_result.stderr
-                    if install_result.stderr
-                    else "npm install failed"
-                )
-                logger.warning(f"   ⚠️ npm install warning: {error_msg}")
-            else:
-                logger.info("   ✅ npm install completed")
+            if install:
+                self.run_npm_install(template_app_dir)
 
             logger.info("   Running: npm run build")
 
@@ -115,13 +190,13 @@ class BuildService:
             env["CI"] = "1"
 
             # Run the build command
-            build_result = subprocess.run(
-                ["npm", "run", "build"],
-                cwd=template_app_dir,
-                env=env,
-                capture_output=True,
-                text=True,
-            )
+            with span("npm run build"):
+                build_result = self.run_command(
+                    ["npm", "run", "build"],
+                    template_app_dir,
+                    self.limits.build_timeout,
+                    env,
+                )
 
             if build_result.returncode != 0:
                 error_msg = (
@@ -134,30 +209,69 @@ class BuildService:
         except Exception as e:
             raise RuntimeError(f"Failed to run build: {str(e)}")
 
+    def run_fast_path_build(self, app_jsx_content: str) -> Optional[Path]:
+        """Build App.jsx with the fast-path bundler into a temporary dist folder
+
+        Returns None if the fast path fails, so the caller can fall back to Vite.
+        """
+        try:
+            with span("fast-path bundle"):
+                html = fast_bundler.bundle(app_jsx_content)
+        except Exception as e:
+            logger.warning(f"⚠️ Fast-path build failed, falling back to Vite: {e}")
+            return None
+
+        temp_app_dir = Path(tempfile.mkdtemp(prefix="expo_build_")) / "app"
+        dist_dir = temp_app_dir / "dist"
+        dist_dir.mkdir(parents=True)
+        with open(dist_dir / "index.html", "w", encoding="utf-8") as f:
+            f.write(html)
+
+        logger.info("⚡ Fast-path build completed successfully")
+        return temp_app_dir
+
+    def upload_variants(self, path: str, file: Path, scratch_dir: Path) -> None:
+        """Upload compressed copies of a file next to it for the bundle server"""
+        for encoding, body in compress_variants(file.read_bytes()).items():
+            variant = scratch_dir / f"{file.name}{VARIANT_SUFFIXES[encoding]}"
+            variant.write_bytes(body)
+            storage.upload(path + VARIANT_SUFFIXES[encoding], variant)
+
     def build_app(
-        self, app_jsx_content: Optional[str] = None, output_dir: Optional[Path] = None
+        self,
+        app_jsx_content: Optional[str] = None,
+        output_dir: Optional[Path] = None,
+        workspace_dir: Optional[Path] = None,
+        fast_path: Optional[bool] = None,
     ) -> Dict[str, Any]:
         """Main function to build the app locally"""
         temp_app_dir = None
+        use_fast_path = FAST_PATH_BUILDS if fast_path is None else fast_path
         try:
             logger.info("🚀 Starting build process...")
 
             # Step 1: Set up the build directory
-            current_dir = Path(__file__).parent
-            template_app_dir = current_dir.parent.parent / "template-web-app"
-            template_app_dir = template_app_dir.resolve()
+            template_app_dir = TEMPLATE_APP_DIR
 
-            if app_jsx_content:
+            if app_jsx_content and use_fast_path:
+                temp_app_dir = self.run_fast_path_build(app_jsx_content)
+
+            if temp_app_dir:
+                # The fast path already wrote dist/index.html
+                build_dir = temp_app_dir
+            elif app_jsx_content:
                 # Copy template-app + custom index.jsx to temporary directory
-                temp_app_dir = self.copy_template_with_custom_index(
-                    template_app_dir, app_jsx_content
-                )
+                with span("copy template"):
+                    temp_app_dir = self.copy_template_with_custom_index(
+                        template_app_dir, app_jsx_content, workspace_dir
+                    )
                 build_dir = temp_app_dir
+                # Dependencies are already installed in a shared workspace
+                self.run_html_export(build_dir, install=not workspace_dir)
             else:
                 # Use original template-app directory
                 build_dir = template_app_dir
-
-            self.run_html_export(build_dir)
+                self.run_html_export(build_dir)
 
             # Step 2: Check if dist folder exists
             dist_dir = build_dir / "dist"
@@ -192,12 +306,15 @@ class BuildService:
 
             build_id = str(uuid.uuid4())
 
-            # Upload files to supabase storage
-            for file in all_files:
-                supabase.storage.from_("apps").upload(
-                    file=file,
-                    path=f"deployments/{build_id}/{file.name}",
-                )
+            # Upload files to deployment storage (supabase unless configured otherwise)
+            with (
+                span("upload", files=len(all_files)),
+                tempfile.TemporaryDirectory() as scratch,
+            ):
+                for file in all_files:
+                    path = f"deployments/{build_id}/{file.name}"
+                    storage.upload(path, file)
+                    self.upload_variants(path, file, Path(scratch))
 
             return {
                 "success": True,
@@ -207,6 +324,7 @@ class BuildService:
                 "outputDir": str(output_dir) if output_dir else None,
                 "fileCount": len(all_files),
                 "files": [str(f.relative_to(dist_dir)) for f in all_files],
+                "resourceUsage": self.resource_usage,
             }
 
         except Exception as error:
@@ -219,7 +337,10 @@ class BuildService:
 
 
 def build_app_local(
-    app_jsx_content: Optional[str] = None, output_dir: Optional[str] = None
+    app_jsx_content: Optional[str] = None,
+    output_dir: Optional[str] = None,
+    workspace_dir: Optional[str] = None,
+    fast_path: Optional[bool] = None,
 ) -> Dict[str, Any]:
     """
     Build app locally without any API calls
@@ -227,13 +348,44 @@ def build_app_local(
     Args:
         app_jsx_content: Optional custom JSX content for App.jsx
         output_dir: Optional directory to copy the build output to
+        workspace_dir: Optional shared workspace from prepare_shared_workspace
+        fast_path: Skip Vite and use the fast-path bundler (defaults to FAST_PATH_BUILDS)
 
     Returns:
         Dictionary with build results and information
     """
     build_service = BuildService()
     output_path = Path(output_dir) if output_dir else None
-    return build_service.build_app(app_jsx_content, output_path)
+    workspace_path = Path(workspace_dir) if workspace_dir else None
+    return build_service.build_app(
+        app_jsx_content, output_path, workspace_path, fast_path
+    )
+
+
+def compare_fast_path_with_vite(app_jsx_content: str) -> Dict[str, Any]:
+    """
+    Build the same App.jsx with Vite and with the fast path and compare them
+
+    Args:
+        app_jsx_content: JSX content for App.jsx
+
+    Returns:
+        Dictionary with the comparison report (see compare_builds)
+    """
+    build_service = BuildService()
+    fast_html = fast_bundler.bundle(app_jsx_content)
+
+    temp_app_dir = build_service.copy_template_with_custom_index(
+        TEMPLATE_APP_DIR, app_jsx_content
+    )
+    try:
+        build_service.run_html_export(temp_app_dir)
+        with open(temp_app_dir / "dist" / "index.html", "r", encoding="utf-8") as f:
+            vite_html = f.read()
+    finally:
+        build_service.cleanup_temp_directory(temp_app_dir.parent)
+
+    return compare_builds(vite_html, fast_html)
 
 
 def build_app_from_file(
@@ -285,5 +437,8 @@ if __name__ == "__main__":
         # result = build_app_local(custom_jsx, "./custom_build")
         # print(f"Custom build successful: {result}")
 
+        # Or check that the fast path matches the Vite output
+        # print(compare_fast_path_with_vite(custom_jsx))
+
     except Exception as e:
         logger.error(f"Build failed: {e}")
@@ -1,7 +1,18 @@
+from datetime import datetime, timezone
+
 from sqlalchemy.orm import DeclarativeBase
 from enrichmcp.sqlalchemy import EnrichSQLAlchemyMixin
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import String, Integer, Float, Boolean
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+from sqlalchemy import (
+    String,
+    Integer,
+    Float,
+    Boolean,
+    DateTime,
+    ForeignKey,
+    LargeBinary,
+    UniqueConstraint,
+)
 
 
 class Base(DeclarativeBase, EnrichSQLAlchemyMixin):
@@ -20,5 +31,40 @@ class MiniApp(Base):
     icon_url: Mapped[str | None] = mapped_column(String, nullable=True)
     version: Mapped[str] = mapped_column(String)
     rating: Mapped[float] = mapped_column(Float)
+    rating_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
     downloads: Mapped[int] = mapped_column(Integer)
     is_featured: Mapped[bool] = mapped_column(Boolean)
+
+    versions: Mapped[list["AppVersion"]] = relationship(
+        back_populates="app", order_by="AppVersion.number"
+    )
+
+
+class AppVersion(Base):
+    """One built revision of a MiniApp's App.jsx.
+
+    The source is stored zlib-compressed, either in full (a snapshot) or as a
+    line delta against the parent version (see src/deployment_history.py).
+    """
+
+    __tablename__ = "app_versions"
+    __table_args__ = (UniqueConstraint("app_id", "number"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    app_id: Mapped[int] = mapped_column(ForeignKey("mini_apps.id"), index=True)
+    parent_id: Mapped[int | None] = mapped_column(
+        ForeignKey("app_versions.id"), nullable=True
+    )
+    number: Mapped[int] = mapped_column(Integer)
+    deployment_id: Mapped[str] = mapped_column(String, unique=True)
+    is_snapshot: Mapped[bool] = mapped_column(Boolean)
+    payload: Mapped[bytes] = mapped_column(LargeBinary)
+    content_hash: Mapped[str] = mapped_column(String)
+    # Set once the build's storage objects were garbage collected
+    build_pruned: Mapped[bool] = mapped_column(Boolean, default=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=lambda: datetime.now(timezone.utc)
+    )
+
+    app: Mapped[MiniApp] = relationship(back_populates="versions")
+    parent: Mapped["AppVersion | None"] = relationship(remote_side=[id])
@@ -0,0 +1,247 @@
+"""On-demand profiling of generate/edit runs.
+
+A profiled run samples the call stack of the thread it runs in every
+PROFILE_SAMPLE_INTERVAL seconds (wall clock, so time blocked on subprocesses
+and network shows up) and records a timeline of named spans plus the resource
+usage of every build subprocess. Collapsed stacks (flamegraph format), a text
+summary and the timeline are written to PROFILE_DIR/<profile_id>/ for download.
+
+Only the profiled thread is sampled, so other jobs run alongside it unaffected
+and stay out of its profile. Work it hands to other threads (LLM requests on
+the client loop) shows up as the frame waiting for it.
+"""
+
+import io
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from log import logger
+
+PROFILE_DIR = Path(
+    os.getenv(
+        "PROFILE_DIR", os.path.join(os.path.dirname(__file__), "..", "logs", "profiles")
+    )
+).resolve()
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+PROFILE_ARTIFACTS = ("stacks.txt", "summary.txt", "timeline.json")
+
+
+class ProfileSession:
+    def __init__(self, name: str):
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.name = name
+        self.started_at = time.perf_counter()
+        self.spans: list[dict[str, Any]] = []
+        self.subprocesses: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def offset(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def add_span(self, span: dict[str, Any]) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def add_subprocess(self, entry: dict[str, Any]) -> None:
+        with self._lock:
+            self.subprocesses.append(entry)
+
+
+_current_session: ContextVar[Optional[ProfileSession]] = ContextVar(
+    "profile_session", default=None
+)
+_armed_runs = 0
+_armed_lock = threading.Lock()
+
+
+class _ThreadSampler:
+    """Samples the call stack of one thread at a fixed interval.
+
+    Each sample is weighted by the wall time since the previous one, since the
+    sampler can fall behind its interval while other threads hold the GIL.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        # Seconds attributed to each stack, outermost frame first
+        self.stacks: Counter[tuple[str, ...]] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="profile-sampler", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            if stack:
+                self.samples += 1
+                self.stacks[tuple(reversed(stack))] += now - last
+            last = now
+
+
+@contextmanager
+def span(name: str, **attrs: Any):
+    """Record a named span on the active profile timeline (no-op otherwise)."""
+    session = _current_session.get()
+    if session is None:
+        yield
+        return
+
+    start = session.offset()
+    try:
+        yield
+    finally:
+        session.add_span(
+            {
+                "name": name,
+                "start": round(start, 4),
+                "duration": round(session.offset() - start, 4),
+                **attrs,
+            }
+        )
+
+
+def record_subprocess(
+    command: list[str], duration: float, returncode: int, peak_rss_kb: int
+) -> None:
+    """Record a finished subprocess on the active profile (no-op otherwise)."""
+    session = _current_session.get()
+    if session is None:
+        return
+    session.add_subprocess(
+        {
+            "command": " ".join(command),
+            "end": round(session.offset(), 4),
+            "duration": round(duration, 4),
+            "returncode": returncode,
+            "peak_rss_kb": peak_rss_kb,
+        }
+    )
+
+
+def arm(runs: int = 1) -> int:
+    """Profile the next `runs` generate/edit runs. Returns the armed count."""
+    global _armed_runs
+    with _armed_lock:
+        _armed_runs += runs
+        return _armed_runs
+
+
+def consume_armed() -> bool:
+    global _armed_runs
+    with _armed_lock:
+        if _armed_runs > 0:
+            _armed_runs -= 1
+            return True
+        return False
+
+
+def _summarize(sampler: _ThreadSampler, limit: int = 60) -> str:
+    """Functions by time spent in them or their callees, and by own time."""
+    cumulative: Counter[str] = Counter()
+    own: Counter[str] = Counter()
+    for stack, seconds in sampler.stacks.items():
+        own[stack[-1]] += seconds
+        for function in set(stack):
+            cumulative[function] += seconds
+
+    total = sum(sampler.stacks.values()) or 1
+    summary = io.StringIO()
+    summary.write(
+        f"{sampler.samples} samples of thread {sampler.thread_id} "
+        f"over {total:.3f} s (interval {sampler.interval * 1000:g} ms)\n"
+    )
+    for title, times in (("cumulative", cumulative), ("own", own)):
+        summary.write(f"\n{'seconds':>9} {'%':>6}  {title}\n")
+        for function, seconds in times.most_common(limit):
+            summary.write(
+                f"{seconds:>9.3f} {100 * seconds / total:>6.1f}  {function}\n"
+            )
+    return summary.getvalue()
+
+
+def _write_artifacts(session: ProfileSession, sampler: _ThreadSampler) -> Path:
+    target = PROFILE_DIR / session.id
+    target.mkdir(parents=True, exist_ok=True)
+
+    # Collapsed stacks weighted in milliseconds, for flamegraph.pl or speedscope
+    (target / "stacks.txt").write_text(
+        "".join(
+            f"{';'.join(stack)} {round(seconds * 1000)}\n"
+            for stack, seconds in sampler.stacks.items()
+        )
+    )
+    (target / "summary.txt").write_text(_summarize(sampler))
+
+    timeline = {
+        "id": session.id,
+        "name": session.name,
+        "total_seconds": round(session.offset(), 4),
+        "samples": sampler.samples,
+        "sample_interval": sampler.interval,
+        "spans": sorted(session.spans, key=lambda s: s["start"]),
+        "subprocesses": session.subprocesses,
+    }
+    (target / "timeline.json").write_text(json.dumps(timeline, indent=2))
+    return target
+
+
+def run_profiled(name: str, func: Callable[..., dict], *args: Any) -> dict:
+    """Run func in the current thread, sampling its stack, and attach the profile id.
+
+    Only this thread is sampled, so other pipeline jobs keep running meanwhile
+    and do not appear in the profile.
+    """
+    session = ProfileSession(name)
+    token = _current_session.set(session)
+    sampler = _ThreadSampler(threading.get_ident(), PROFILE_SAMPLE_INTERVAL)
+    sampler.start()
+    try:
+        result = func(*args)
+    finally:
+        sampler.stop()
+        _current_session.reset(token)
+        target = _write_artifacts(session, sampler)
+        logger.info(f"Profile for {name} written to {target}")
+
+    return {**result, "profile_id": session.id}
+
+
+def list_profiles() -> list[str]:
+    if not PROFILE_DIR.exists():
+        return []
+    return sorted((p.name for p in PROFILE_DIR.iterdir() if p.is_dir()), reverse=True)
+
+
+def artifact_path(profile_id: str, artifact: str) -> Optional[Path]:
+    if artifact not in PROFILE_ARTIFACTS or "/" in profile_id or ".." in profile_id:
+        return None
+    path = PROFILE_DIR / profile_id / artifact
+    return path if path.is_file() else None
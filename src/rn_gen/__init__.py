@@ -6,18 +6,26 @@ import tempfile
 
 from dotenv import load_dotenv
 from langchain.prompts import PromptTemplate
-from langchain_core.output_parsers import PydanticOutputParser
 from log import logger
 from src.js_bundle_upload.main import build_app_local
+from src.deployment_history import new_version
 from src.models import MiniApp
 from src.supabase import supabase
 
 from .prompt import EDITOR_PROMPT, METADATA_EDITOR_PROMPT, METADATA_PROMPT, PROMPT
+from .scheduler import (
+    PRIORITY_CODE,
+    PRIORITY_EDIT,
+    PRIORITY_GENERATE,
+    PRIORITY_METADATA,
+)
+from .structured import structured_chain
 from .utils import (
     AppMetadata,
     AppSpec,
     OpenRouterClient,
     insert_into_db,
+    insert_many_into_db,
     update_app_in_db,
 )
 from kit.summaries import OpenAIConfig, AnthropicConfig, GoogleConfig
@@ -26,7 +34,12 @@ from kit.repository import Repository
 
 load_dotenv()
 
-llm = OpenRouterClient(model_name="anthropic/claude-sonnet-4")
+llm = OpenRouterClient(
+    model_name="anthropic/claude-sonnet-4",
+    request_timeout=float(os.getenv("LLM_REQUEST_TIMEOUT", "120")),
+    deadline=float(os.getenv("LLM_DEADLINE", "300")),
+    fallback_model=os.getenv("OPENROUTER_FALLBACK_MODEL", "openai/gpt-4.1"),
+)
 
 openrouter_config = OpenAIConfig(
     api_key=os.getenv("OPENROUTER_API_KEY"),  # Replace with your OpenRouter key
@@ -35,11 +48,12 @@ openrouter_config = OpenAIConfig(
 )
 
 
-def generate_app(user_request: str) -> AppSpec:
+def generate_app(user_request: str, priority: int = PRIORITY_GENERATE) -> AppSpec:
     """Generate React Native app JSX code based on user request.
 
     Args:
         user_request (str): The user's request for the app.
+        priority (int): Scheduling tier of the LLM call (see scheduler.py).
 
     Returns:
         str: The generated JSX code for the app.
@@ -48,43 +62,44 @@ def generate_app(user_request: str) -> AppSpec:
         p = file.read()
 
     prompt = PromptTemplate.from_template(PROMPT)
-    parser = PydanticOutputParser(pydantic_object=AppSpec)
 
-    chain = prompt | llm | parser
+    chain = structured_chain(prompt, llm, AppSpec)
 
     output: AppSpec = chain.invoke(
         {
             "prompt": p,
             "user_request": user_request,
-            "format_instructions": parser.get_format_instructions(),
-        }
+        },
+        config={"metadata": {"llm_priority": priority + PRIORITY_CODE}},
     )
 
     return output
 
 
-def generate_metadata(user_request: str) -> dict:
+def generate_metadata(
+    user_request: str, priority: int = PRIORITY_GENERATE
+) -> AppMetadata:
     prompt = PromptTemplate.from_template(METADATA_PROMPT)
-    parser = PydanticOutputParser(pydantic_object=AppMetadata)
 
-    chain = prompt | llm | parser
+    chain = structured_chain(prompt, llm, AppMetadata)
 
-    output: AppSpec = chain.invoke(
+    output: AppMetadata = chain.invoke(
         {
             "user_request": user_request,
-            "format_instructions": parser.get_format_instructions(),
-        }
+        },
+        config={"metadata": {"llm_priority": priority + PRIORITY_METADATA}},
     )
 
     return output
 
 
-def edit_app(user_request: str, previous_app_code: str) -> AppSpec:
+def edit_app(
+    user_request: str, previous_app_code: str, priority: int = PRIORITY_EDIT
+) -> AppSpec:
     with open(os.path.join(os.path.dirname(__file__), "prompt.txt"), "r") as file:
         p = file.read()
 
     prompt = PromptTemplate.from_template(EDITOR_PROMPT)
-    parser = PydanticOutputParser(pydantic_object=AppSpec)
 
     # Create a temp folder to store the previous_app_code
     temp_folder = tempfile.mkdtemp()
@@ -98,7 +113,7 @@ def edit_app(user_request: str, previous_app_code: str) -> AppSpec:
     path_to_previous_app_code = os.path.join(temp_folder, "previous_app_code.jsx")
     summary = summarizer.summarize_file(path_to_previous_app_code)
 
-    chain = prompt | llm | parser
+    chain = structured_chain(prompt, llm, AppSpec)
 
     return chain.invoke(
         {
@@ -106,29 +121,50 @@ def edit_app(user_request: str, previous_app_code: str) -> AppSpec:
             "summary": summary,
             "user_request": user_request,
             "previous_app_code": previous_app_code,
-            "format_instructions": parser.get_format_instructions(),
-        }
+        },
+        config={"metadata": {"llm_priority": priority + PRIORITY_CODE}},
     )
 
 
 def edit_app_metadata(
     user_request: str,
     previous_app_metadata: AppMetadata,
+    priority: int = PRIORITY_EDIT,
 ) -> AppMetadata:
     prompt = PromptTemplate.from_template(METADATA_EDITOR_PROMPT)
-    parser = PydanticOutputParser(pydantic_object=AppMetadata)
 
-    chain = prompt | llm | parser
+    chain = structured_chain(prompt, llm, AppMetadata)
 
     return chain.invoke(
         {
             "user_request": user_request,
             "previous_app_metadata": previous_app_metadata,
-            "format_instructions": parser.get_format_instructions(),
-        }
+        },
+        config={"metadata": {"llm_priority": priority + PRIORITY_METADATA}},
     )
 
 
+def new_mini_app(
+    app_metadata: AppMetadata, deployment_id: str, app_jsx: str
+) -> MiniApp:
+    """Create a MiniApp row and its first version for a freshly built deployment."""
+    mini_app = MiniApp(
+        name=app_metadata.name,
+        description=app_metadata.description,
+        category=app_metadata.category,
+        tags=app_metadata.tags,
+        deployment_id=deployment_id,
+        icon_url=app_metadata.app_icon,
+        version="1.0.0",
+        rating=round(random.uniform(4.1, 5), 1),
+        rating_count=0,
+        downloads=1,
+        is_featured=random.random() < 0.3,
+    )
+    new_version(mini_app, deployment_id, app_jsx)
+    return mini_app
+
+
 def build_and_upload_to_supabase(
     app_spec: AppSpec,
     app_metadata: AppMetadata,
@@ -151,18 +187,7 @@ def build_and_upload_to_supabase(
         logger.info(result)
 
         # Create a MiniApp object
-        mini_app = MiniApp(
-            name=app_metadata.name,
-            description=app_metadata.description,
-            category=app_metadata.category,
-            tags=app_metadata.tags,
-            deployment_id=result["buildId"],
-            icon_url=app_metadata.app_icon,
-            version="1.0.0",
-            rating=round(random.uniform(4.1, 5), 1),
-            downloads=1,
-            is_featured=random.random() < 0.3,
-        )
+        mini_app = new_mini_app(app_metadata, result["buildId"], app_spec.app_jsx)
 
         # Insert into DB
         success = insert_into_db(mini_app)
@@ -204,7 +229,9 @@ def build_and_update_in_supabase(
         new_deployment_id = result["buildId"]
 
         # Update the existing app in the database
-        success = update_app_in_db(deployment_id, app_metadata, new_deployment_id)
+        success = update_app_in_db(
+            deployment_id, app_metadata, new_deployment_id, app_spec.app_jsx
+        )
 
         # Return success status and new deployment ID
         return success, new_deployment_id
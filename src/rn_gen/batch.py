@@ -0,0 +1,111 @@
+"""Batch generation of many apps through a shared build workspace."""
+
+import asyncio
+import os
+from pathlib import Path
+from typing import AsyncIterator
+
+from log import logger
+from src.js_bundle_upload.main import BuildService, build_app_local
+
+from . import generate_app, generate_metadata, insert_many_into_db, new_mini_app
+from .scheduler import PRIORITY_BATCH
+
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+BATCH_BUILD_CONCURRENCY = int(os.getenv("BATCH_BUILD_CONCURRENCY", "2"))
+
+
+async def generate_apps_batch(
+    user_requests: list[str],
+    llm_concurrency: int = BATCH_LLM_CONCURRENCY,
+    build_concurrency: int = BATCH_BUILD_CONCURRENCY,
+) -> AsyncIterator[dict]:
+    """Generate, build and upload apps for many requests.
+
+    Yields one result per request as soon as it is built (in completion order),
+    followed by a final summary once all MiniApp rows are bulk inserted; an
+    item is only stored once the summary reports "inserted". The insert also
+    runs if the consumer stops iterating early.
+
+    Args:
+        user_requests (list[str]): The user requests to generate apps for.
+        llm_concurrency (int): Maximum number of requests in the LLM stage at once.
+        build_concurrency (int): Maximum number of concurrent vite builds.
+    """
+    build_service = BuildService()
+    workspace_dir: Path = await asyncio.to_thread(
+        build_service.prepare_shared_workspace
+    )
+    llm_slots = asyncio.Semaphore(llm_concurrency)
+    build_slots = asyncio.Semaphore(build_concurrency)
+
+    mini_apps = []
+    builds: set[asyncio.Future] = set()
+
+    async def build_item(app_spec, app_metadata):
+        result = await asyncio.to_thread(
+            build_app_local, app_spec.app_jsx, None, str(workspace_dir)
+        )
+        mini_app = new_mini_app(app_metadata, result["buildId"], app_spec.app_jsx)
+        mini_apps.append(mini_app)
+        return mini_app
+
+    async def run_item(user_request: str):
+        async with llm_slots:
+            app_spec, app_metadata = await asyncio.gather(
+                asyncio.to_thread(generate_app, user_request, PRIORITY_BATCH),
+                asyncio.to_thread(generate_metadata, user_request, PRIORITY_BATCH),
+            )
+        async with build_slots:
+            # Cancelling the item does not stop the build thread, so a started
+            # build is shielded and always completes and gets its row
+            build = asyncio.ensure_future(build_item(app_spec, app_metadata))
+            builds.add(build)
+            return await asyncio.shield(build)
+
+    async def finish() -> bool:
+        await asyncio.gather(*builds, return_exceptions=True)
+        build_service.cleanup_temp_directory(workspace_dir.parent)
+        if not mini_apps:
+            return True
+        return await asyncio.to_thread(insert_many_into_db, mini_apps)
+
+    async def run_indexed(index: int, user_request: str):
+        try:
+            return index, await run_item(user_request), None
+        except Exception as e:
+            logger.error(f"Batch item {index} failed: {str(e)}")
+            return index, None, e
+
+    tasks = []
+    inserted = False
+    try:
+        tasks = [
+            asyncio.ensure_future(run_indexed(index, user_request))
+            for index, user_request in enumerate(user_requests)
+        ]
+        for next_done in asyncio.as_completed(tasks):
+            index, mini_app, error = await next_done
+            if error is not None:
+                yield {"index": index, "built": False, "error": str(error)}
+                continue
+
+            yield {
+                "index": index,
+                "built": True,
+                "deployment_id": mini_app.deployment_id,
+                "name": mini_app.name,
+            }
+    finally:
+        # Stop outstanding work if the consumer went away early; builds that
+        # already started still finish, then every built app is inserted
+        for task in tasks:
+            task.cancel()
+        inserted = await asyncio.shield(finish())
+
+    yield {
+        "summary": True,
+        "requested": len(user_requests),
+        "built": len(mini_apps),
+        "inserted": inserted,
+    }
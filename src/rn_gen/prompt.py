@@ -5,9 +5,7 @@ User Request (App to Generate):
 
 {user_request}
 
-Return your code ONLY in the following format (strictly):
-
-{format_instructions}
+Return the complete App.jsx code in the `app_jsx` field.
 """
 
 EDITOR_PROMPT = """
@@ -26,9 +24,7 @@ Previous App Code:
 Previous App Code Summary:
 {summary}
 
-Return your code ONLY in the following format (strictly):
-
-{format_instructions}
+Return the complete App.jsx code in the `app_jsx` field.
 """
 
 
@@ -45,8 +41,6 @@ Notes:
     
 User Request:
 {user_request}
-
-{format_instructions}
 """
 
 
@@ -68,6 +62,4 @@ User Request (Changes to the app):
 
 Previous App Metadata:
 {previous_app_metadata}
-
-{format_instructions}
 """
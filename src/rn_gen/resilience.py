@@ -0,0 +1,121 @@
+"""Retry, hedging and circuit breaking primitives for LLM calls."""
+
+import math
+import random
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+import openai
+
+RETRIABLE_STATUS_CODES = {408, 409, 429}
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a call runs out of its overall deadline."""
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised when the circuit is open and no fallback model is configured."""
+
+
+def is_retriable(error: BaseException) -> bool:
+    """Return True if the error is worth retrying against the same upstream."""
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRIABLE_STATUS_CODES or error.status_code >= 500
+    return False
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Exponential backoff with full jitter for the given (zero based) attempt."""
+    return random.uniform(0, min(max_delay, base_delay * (2**attempt)))
+
+
+class LatencyTracker:
+    """Rolling window of call latencies used to pick the hedging delay."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Return the p-th percentile latency, or None until enough samples exist."""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+
+        index = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    The circuit opens after ``failure_threshold`` consecutive failures and stays
+    open for ``recovery_timeout`` seconds. After that a single probe request is
+    let through (half-open); its outcome closes or re-opens the circuit.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> Optional[str]:
+        """Admit a request: returns "request", "probe" (half-open) or None.
+
+        Whoever gets "probe" must end it with record_success, record_failure
+        or release_probe, or no further probe is ever let through.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return "request"
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_timeout:
+                    return None
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self._probe_in_flight:
+                return None
+            self._probe_in_flight = True
+            return "probe"
+
+    def allow_request(self) -> bool:
+        return self.try_acquire() is not None
+
+    def release_probe(self) -> None:
+        """Give up a probe that ended without an outcome (e.g. cancelled)."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probe_in_flight = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
@@ -0,0 +1,231 @@
+"""Rate-limit aware, priority ordered scheduling of LLM requests."""
+
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from typing import Mapping, Optional
+
+from log import logger
+
+from .resilience import DeadlineExceeded
+
+# Lower values are dispatched first. Within a tier metadata goes before code.
+PRIORITY_EDIT = 0
+PRIORITY_GENERATE = 10
+PRIORITY_BATCH = 20
+PRIORITY_METADATA = 0
+PRIORITY_CODE = 1
+
+DEFAULT_RETRY_AFTER = 5.0
+
+
+def estimate_tokens(prompt_chars: int, max_completion_tokens: int) -> int:
+    """Rough token estimate: ~4 characters per prompt token plus the completion budget."""
+    return prompt_chars // 4 + max_completion_tokens
+
+
+def _header(headers: Mapping[str, str], name: str) -> Optional[float]:
+    for key, value in headers.items():
+        if key.lower() == name:
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return None
+    return None
+
+
+def _first_header(headers: Mapping[str, str], *names: str) -> Optional[float]:
+    """The first of names present in headers, so that a value of 0 is kept."""
+    for name in names:
+        value = _header(headers, name)
+        if value is not None:
+            return value
+    return None
+
+
+class QueueTimeout(DeadlineExceeded):
+    """Raised when a call's deadline would pass while it waits for a slot."""
+
+
+class AcquireCancelled(Exception):
+    """Raised by acquire when its wait was withdrawn with cancel."""
+
+
+class RateLimitScheduler:
+    """Token buckets for requests and tokens per minute with a priority queue.
+
+    Callers block in ``acquire`` until they are at the head of the queue and
+    both buckets can cover the request. Budgets start from the configured
+    limits and are corrected from provider rate limit headers and 429s.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._queue: list[tuple[int, int]] = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._waits: deque[float] = deque(maxlen=200)
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        self._requests = min(
+            self.requests_per_minute,
+            self._requests + elapsed * self.requests_per_minute / 60,
+        )
+        self._tokens = min(
+            self.tokens_per_minute,
+            self._tokens + elapsed * self.tokens_per_minute / 60,
+        )
+
+    def _seconds_until_ready(self, tokens: int, now: float) -> float:
+        return max(
+            0.0,
+            self._paused_until - now,
+            (1 - self._requests) * 60 / self.requests_per_minute,
+            (tokens - self._tokens) * 60 / self.tokens_per_minute,
+        )
+
+    def acquire(
+        self,
+        estimated_tokens: int,
+        priority: int,
+        timeout: Optional[float] = None,
+        cancel: Optional[threading.Event] = None,
+    ) -> float:
+        """Block until the request may be sent. Returns the time spent waiting.
+
+        Raises QueueTimeout if no slot can be had within ``timeout`` seconds,
+        and AcquireCancelled once ``cancel`` is set through ``cancel()``. In
+        both cases the request leaves the queue without taking a slot.
+        """
+        # A request larger than the whole budget would otherwise wait forever
+        tokens = min(estimated_tokens, int(self.tokens_per_minute))
+        entry = (priority, next(self._sequence))
+        start = time.monotonic()
+        expires_at = None if timeout is None else start + timeout
+
+        with self._condition:
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    if cancel is not None and cancel.is_set():
+                        raise AcquireCancelled()
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._queue[0] != entry:
+                        delay = None
+                    else:
+                        delay = self._seconds_until_ready(tokens, now)
+                        if delay <= 0:
+                            break
+                    if expires_at is not None:
+                        # Give up now if the slot would come after the deadline
+                        remaining = expires_at - now
+                        if remaining <= 0 or (delay is not None and delay > remaining):
+                            raise QueueTimeout(
+                                "LLM call deadline passed while waiting for a "
+                                "rate limit slot"
+                            )
+                        delay = remaining if delay is None else delay
+                    self._condition.wait(timeout=delay)
+
+                self._requests -= 1
+                self._tokens -= tokens
+            finally:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._condition.notify_all()
+
+        waited = time.monotonic() - start
+        self._waits.append(waited)
+        return waited
+
+    def cancel(self, event: threading.Event) -> None:
+        """Withdraw the acquire call waiting with ``event`` from the queue."""
+        with self._condition:
+            event.set()
+            self._condition.notify_all()
+
+    def settle(self, estimated_tokens: int, actual_tokens: Optional[int]) -> None:
+        """Give back (or charge) the difference between estimated and actual usage."""
+        if actual_tokens is None:
+            return
+        with self._condition:
+            estimated_tokens = min(estimated_tokens, int(self.tokens_per_minute))
+            self._tokens = min(
+                self.tokens_per_minute,
+                self._tokens + estimated_tokens - actual_tokens,
+            )
+            self._condition.notify_all()
+
+    def release(self, estimated_tokens: int) -> None:
+        """Give back a slot taken by acquire for a request that was never sent."""
+        with self._condition:
+            self._refill(time.monotonic())
+            estimated_tokens = min(estimated_tokens, int(self.tokens_per_minute))
+            self._requests = min(self.requests_per_minute, self._requests + 1)
+            self._tokens = min(self.tokens_per_minute, self._tokens + estimated_tokens)
+            self._condition.notify_all()
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """Learn limits and remaining budget from provider rate limit headers."""
+        with self._condition:
+            self._refill(time.monotonic())
+            # OpenAI style headers, or OpenRouter's request-only X-RateLimit-*
+            limit_requests = _first_header(
+                headers, "x-ratelimit-limit-requests", "x-ratelimit-limit"
+            )
+            limit_tokens = _header(headers, "x-ratelimit-limit-tokens")
+            remaining_requests = _first_header(
+                headers, "x-ratelimit-remaining-requests", "x-ratelimit-remaining"
+            )
+            remaining_tokens = _header(headers, "x-ratelimit-remaining-tokens")
+
+            # Refill rates divide by the limits, so ignore a zero limit
+            if limit_requests is not None and limit_requests > 0:
+                self.requests_per_minute = limit_requests
+            if limit_tokens is not None and limit_tokens > 0:
+                self.tokens_per_minute = limit_tokens
+            if remaining_requests is not None:
+                self._requests = min(self._requests, remaining_requests)
+            if remaining_tokens is not None:
+                self._tokens = min(self._tokens, remaining_tokens)
+            self._condition.notify_all()
+
+    def penalize(self, headers: Optional[Mapping[str, str]] = None) -> None:
+        """Pause dispatching after a 429, honouring Retry-After when present."""
+        retry_after = _header(headers or {}, "retry-after") or DEFAULT_RETRY_AFTER
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            self._requests = 0.0
+        logger.warning(f"LLM rate limited, pausing dispatch for {retry_after:.1f}s")
+
+    def stats(self) -> dict:
+        with self._condition:
+            self._refill(time.monotonic())
+            waits = list(self._waits)
+            return {
+                "queue_depth": len(self._queue),
+                "avg_wait_seconds": sum(waits) / len(waits) if waits else 0.0,
+                "max_wait_seconds": max(waits, default=0.0),
+                "requests_per_minute": self.requests_per_minute,
+                "tokens_per_minute": self.tokens_per_minute,
+                "requests_available": self._requests,
+                "tokens_available": self._tokens,
+                "paused_for_seconds": max(0.0, self._paused_until - time.monotonic()),
+            }
+
+
+scheduler = RateLimitScheduler(
+    requests_per_minute=float(os.getenv("LLM_REQUESTS_PER_MINUTE", "60")),
+    tokens_per_minute=float(os.getenv("LLM_TOKENS_PER_MINUTE", "400000")),
+)
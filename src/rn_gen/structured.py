@@ -0,0 +1,242 @@
+"""Provider-native structured output for the generation chains.
+
+Chains bind the pydantic schema as a tool (or a JSON schema response format)
+instead of pasting ``PydanticOutputParser`` format instructions into the
+prompt. If the provider still returns something the schema rejects, a cheap
+local repair step re-extracts the JSON from the raw message before giving up.
+"""
+
+import json
+import os
+import sys
+import threading
+from collections import defaultdict
+from functools import partial
+from typing import Any, Type, TypeVar
+
+from langchain.prompts import PromptTemplate
+from langchain_core.exceptions import OutputParserException
+from langchain_core.messages import AIMessage
+from langchain_core.output_parsers import PydanticOutputParser
+from langchain_core.runnables import Runnable, RunnableLambda
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from langchain_core.utils.json import parse_json_markdown
+from log import logger
+from pydantic import BaseModel, ValidationError
+
+STRUCTURED_OUTPUT_METHOD = os.getenv("LLM_STRUCTURED_OUTPUT_METHOD", "function_calling")
+
+T = TypeVar("T", bound=BaseModel)
+
+
+class StructuredOutputStats:
+    """Per-schema counters for token usage and parse outcomes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: dict[str, dict[str, int]] = defaultdict(
+            lambda: {
+                "calls": 0,
+                "repaired": 0,
+                "failures": 0,
+                "input_tokens": 0,
+                "output_tokens": 0,
+            }
+        )
+
+    def record(
+        self,
+        schema_name: str,
+        usage: dict,
+        repaired: bool = False,
+        failed: bool = False,
+    ) -> None:
+        with self._lock:
+            stats = self._stats[schema_name]
+            stats["calls"] += 1
+            stats["repaired"] += int(repaired)
+            stats["failures"] += int(failed)
+            stats["input_tokens"] += usage.get("input_tokens", 0)
+            stats["output_tokens"] += usage.get("output_tokens", 0)
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        with self._lock:
+            result = {}
+            for name, stats in self._stats.items():
+                calls = stats["calls"] or 1
+                result[name] = {
+                    **stats,
+                    "failure_rate": stats["failures"] / calls,
+                    "avg_input_tokens": stats["input_tokens"] / calls,
+                }
+            return result
+
+
+stats = StructuredOutputStats()
+
+
+def repair_output(raw: AIMessage, schema: Type[T]) -> T:
+    """Recover a schema instance from a raw message the structured parser rejected.
+
+    Tries tool call arguments first, then invalid tool call argument strings,
+    then the message content (stripping markdown fences and trailing prose).
+    """
+    candidates: list[Any] = [call["args"] for call in raw.tool_calls]
+    candidates += [call["args"] for call in raw.invalid_tool_calls if call["args"]]
+    if isinstance(raw.content, str) and raw.content.strip():
+        candidates.append(raw.content)
+
+    last_error: Exception | None = None
+    for candidate in candidates:
+        try:
+            if isinstance(candidate, str):
+                candidate = parse_json_markdown(candidate)
+            return schema.model_validate(candidate)
+        except (ValueError, ValidationError, json.JSONDecodeError) as e:
+            last_error = e
+
+    raise OutputParserException(
+        f"Could not parse {schema.__name__} from model output: {last_error}",
+        llm_output=str(raw.content),
+    )
+
+
+def _parse_or_repair(output: dict, schema: Type[T]) -> T:
+    raw: AIMessage = output["raw"]
+    usage = raw.usage_metadata or {}
+
+    if output.get("parsed") is not None:
+        stats.record(schema.__name__, usage)
+        return output["parsed"]
+
+    try:
+        parsed = repair_output(raw, schema)
+    except OutputParserException:
+        stats.record(schema.__name__, usage, failed=True)
+        logger.error(
+            f"Structured output for {schema.__name__} failed: {output.get('parsing_error')}"
+        )
+        raise
+
+    logger.warning(f"Repaired malformed structured output for {schema.__name__}")
+    stats.record(schema.__name__, usage, repaired=True)
+    return parsed
+
+
+def structured_chain(
+    prompt: PromptTemplate,
+    llm,
+    schema: Type[T],
+    method: str = STRUCTURED_OUTPUT_METHOD,
+) -> Runnable:
+    """Build ``prompt | llm`` with native structured output for ``schema``."""
+    structured_llm = llm.with_structured_output(schema, method=method, include_raw=True)
+    return (
+        prompt
+        | structured_llm
+        | RunnableLambda(partial(_parse_or_repair, schema=schema))
+    )
+
+
+def measure_prompt_overhead(llm, template: str, schema: Type[BaseModel]) -> dict:
+    """Compare schema token overhead of format instructions vs. a native tool schema.
+
+    The native schema is still sent to the provider (as a tool definition), so
+    it is counted too; the saving is the difference between the two.
+    """
+    format_instructions = PydanticOutputParser(
+        pydantic_object=schema
+    ).get_format_instructions()
+    tool_schema = json.dumps(convert_to_openai_tool(schema))
+
+    before = llm.get_num_tokens(template) + llm.get_num_tokens(format_instructions)
+    after = llm.get_num_tokens(template) + llm.get_num_tokens(tool_schema)
+    return {
+        "schema": schema.__name__,
+        "before_tokens": before,
+        "after_tokens": after,
+        "saved_tokens": before - after,
+    }
+
+
+def measure_failure_rate(
+    llm, template: str, schema: Type[BaseModel], inputs: list[dict]
+) -> dict:
+    """Run the same inputs through the legacy parser chain and the native chain."""
+    legacy_parser = PydanticOutputParser(pydantic_object=schema)
+    legacy_chain = (
+        PromptTemplate.from_template(template + "\n\n{format_instructions}")
+        | llm
+        | legacy_parser
+    )
+    native_chain = structured_chain(PromptTemplate.from_template(template), llm, schema)
+
+    legacy_failures = 0
+    native_failures = 0
+    for values in inputs:
+        try:
+            legacy_chain.invoke(
+                {
+                    **values,
+                    "format_instructions": legacy_parser.get_format_instructions(),
+                }
+            )
+        except OutputParserException:
+            legacy_failures += 1
+        try:
+            native_chain.invoke(values)
+        except OutputParserException:
+            native_failures += 1
+
+    return {
+        "schema": schema.__name__,
+        "runs": len(inputs),
+        "legacy_failure_rate": legacy_failures / len(inputs),
+        "native_failure_rate": native_failures / len(inputs),
+        "native_stats": stats.snapshot().get(schema.__name__),
+    }
+
+
+if __name__ == "__main__":
+    # Usage: python -m src.rn_gen.structured [--live "request one" "request two" ...]
+    from src.rn_gen import llm
+    from src.rn_gen.prompt import METADATA_PROMPT, PROMPT
+    from src.rn_gen.utils import AppMetadata, AppSpec
+
+    with open(os.path.join(os.path.dirname(__file__), "prompt.txt"), "r") as file:
+        system_prompt = file.read()
+
+    print(
+        measure_prompt_overhead(
+            llm, PROMPT.format(prompt=system_prompt, user_request=""), AppSpec
+        )
+    )
+    print(
+        measure_prompt_overhead(
+            llm, METADATA_PROMPT.format(user_request=""), AppMetadata
+        )
+    )
+
+    if "--live" in sys.argv:
+        requests = sys.argv[sys.argv.index("--live") + 1 :] or [
+            "A simple todo list app"
+        ]
+        print(
+            measure_failure_rate(
+                llm,
+                METADATA_PROMPT,
+                AppMetadata,
+                [{"user_request": request} for request in requests],
+            )
+        )
+        print(
+            measure_failure_rate(
+                llm,
+                PROMPT,
+                AppSpec,
+                [
+                    {"prompt": system_prompt, "user_request": request}
+                    for request in requests
+                ],
+            )
+        )
@@ -1,27 +1,82 @@
 """LLM client and data models for React Native app generation."""
 
+import asyncio
+import contextvars
 import os
-from typing import Optional
+import threading
+import time
+from typing import Any, Optional
 
+import openai
 from dotenv import load_dotenv
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatResult
 from langchain_core.utils.utils import secret_from_env
 from langchain_openai import ChatOpenAI
 from log import logger
-from pydantic import BaseModel, Field, SecretStr
+from pydantic import BaseModel, Field, PrivateAttr, SecretStr
 from sqlalchemy.exc import SQLAlchemyError
+from src.deployment_history import record_version
 from src.models import MiniApp
-from src.supabase import session
+from src.profiling import span
+from src.supabase import Session
+
+from .resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceeded,
+    LatencyTracker,
+    backoff_delay,
+    is_retriable,
+)
+from .scheduler import (
+    PRIORITY_GENERATE,
+    QueueTimeout,
+    RateLimitScheduler,
+    estimate_tokens,
+)
+from .scheduler import scheduler as default_scheduler
+
+DEFAULT_COMPLETION_TOKENS = 8000
 
 load_dotenv()
 
 
 class OpenRouterClient(ChatOpenAI):
-    """OpenRouter API client for LLM interactions."""
+    """OpenRouter API client for LLM interactions.
+
+    Every call is bounded by ``deadline`` (overridable per call with
+    ``llm.bind(deadline=...)``), retried with jittered backoff on retriable
+    errors, hedged with a duplicate request once it runs past the
+    ``hedge_percentile`` latency, and guarded by a circuit breaker that routes
+    traffic to ``fallback_model`` while the primary model is failing.
+
+    Each request first waits for a slot from the shared rate limit scheduler,
+    ordered by the ``llm_priority`` passed in the run config metadata.
+    """
 
     openai_api_key: Optional[SecretStr] = Field(
         alias="api_key",
         default_factory=secret_from_env("OPENROUTER_API_KEY", default=None),
     )
+    deadline: Optional[float] = Field(
+        default=None, description="Overall seconds budget per call, retries included"
+    )
+    retry_attempts: int = Field(default=2, description="Retries after the first try")
+    retry_base_delay: float = 0.5
+    retry_max_delay: float = 8.0
+    hedge_percentile: Optional[float] = Field(
+        default=95.0,
+        description="Latency percentile after which to hedge; None disables",
+    )
+    hedge_min_samples: int = 20
+    fallback_model: Optional[str] = None
+    breaker_failure_threshold: int = 5
+    breaker_recovery_timeout: float = 30.0
+
+    _breaker: CircuitBreaker = PrivateAttr(default=None)
+    _latencies: LatencyTracker = PrivateAttr(default=None)
+    _scheduler: Optional[RateLimitScheduler] = PrivateAttr(default=None)
 
     @property
     def lc_secrets(self) -> dict[str, str]:
@@ -29,11 +84,309 @@ class OpenRouterClient(ChatOpenAI):
 
     def __init__(self, openai_api_key: Optional[str] = None, **kwargs):
         openai_api_key = openai_api_key or os.environ.get("OPENROUTER_API_KEY")
-        super().__init__(
-            base_url="https://openrouter.ai/api/v1",
-            openai_api_key=openai_api_key,
-            **kwargs,
+        kwargs.setdefault(
+            "base_url",
+            os.environ.get("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
+        )
+        # Retries are handled here so that they share the deadline and breaker
+        kwargs.setdefault("max_retries", 0)
+        # Rate limit headers feed the scheduler's budgets
+        kwargs.setdefault("include_response_headers", True)
+        scheduler = kwargs.pop("scheduler", default_scheduler)
+        super().__init__(openai_api_key=openai_api_key, **kwargs)
+        self._scheduler = scheduler
+        self._breaker = CircuitBreaker(
+            self.breaker_failure_threshold, self.breaker_recovery_timeout
+        )
+        self._latencies = LatencyTracker(min_samples=self.hedge_min_samples)
+
+    def _expires_at(self, kwargs: dict) -> Optional[float]:
+        deadline = kwargs.pop("deadline", self.deadline)
+        return time.monotonic() + deadline if deadline else None
+
+    def _attempt_timeout(self, expires_at: Optional[float]) -> Optional[float]:
+        """Per-attempt timeout: the configured request timeout capped by the deadline."""
+        timeout = (
+            float(self.request_timeout)
+            if isinstance(self.request_timeout, (int, float))
+            else None
+        )
+        if expires_at is None:
+            return timeout
+
+        remaining = expires_at - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded("LLM call deadline exceeded")
+        return min(timeout, remaining) if timeout else remaining
+
+    def _hedge_delay(self, expires_at: Optional[float]) -> Optional[float]:
+        if self.hedge_percentile is None:
+            return None
+        delay = self._latencies.percentile(self.hedge_percentile)
+        if delay is None:
+            return None
+        remaining = None if expires_at is None else expires_at - time.monotonic()
+        timeout = (
+            float(self.request_timeout)
+            if isinstance(self.request_timeout, (int, float))
+            else None
+        )
+        for limit in (timeout, remaining):
+            if limit is not None and delay >= limit:
+                return None
+        return delay
+
+    def _pick_model(self) -> tuple[str, bool]:
+        """Model to call and whether this call is the breaker's half-open probe."""
+        admission = self._breaker.try_acquire()
+        if admission is not None:
+            return self.model_name, admission == "probe"
+        if not self.fallback_model:
+            raise CircuitOpenError(f"Circuit open for model {self.model_name}")
+        logger.warning(
+            f"Circuit open for {self.model_name}, using fallback {self.fallback_model}"
+        )
+        return self.fallback_model, False
+
+    def _record_outcome(self, model: str, error: Optional[BaseException]) -> None:
+        # Also skip calls that timed out in the rate limit queue, unsent
+        if model != self.model_name or isinstance(error, QueueTimeout):
+            return
+        if is_retriable(error) or isinstance(error, DeadlineExceeded):
+            self._breaker.record_failure()
+        elif error is None or isinstance(error, Exception):
+            # Success, or a non-retriable error: the upstream itself answered
+            self._breaker.record_success()
+
+    def _backoff_or_raise(
+        self, error: Exception, attempt: int, expires_at: Optional[float]
+    ) -> float:
+        if not is_retriable(error) or attempt >= self.retry_attempts:
+            raise error
+        delay = backoff_delay(attempt, self.retry_base_delay, self.retry_max_delay)
+        if expires_at is not None and time.monotonic() + delay >= expires_at:
+            raise error
+        logger.warning(f"LLM call failed ({error!r}), retrying in {delay:.2f}s")
+        return delay
+
+    def _schedule_params(self, messages: list[BaseMessage], run_manager) -> tuple:
+        """Estimated token cost and priority of a request for the scheduler."""
+        prompt_chars = sum(len(str(message.content)) for message in messages)
+        estimated_tokens = estimate_tokens(
+            prompt_chars, self.max_tokens or DEFAULT_COMPLETION_TOKENS
         )
+        metadata = run_manager.metadata if run_manager else {}
+        return estimated_tokens, metadata.get("llm_priority", PRIORITY_GENERATE)
+
+    def _log_wait(self, waited: float, priority: int) -> None:
+        if waited > 1:
+            logger.info(f"LLM request (priority {priority}) queued for {waited:.2f}s")
+
+    def _settle(self, estimated_tokens: int, result: ChatResult) -> None:
+        if result.generations:
+            headers = (result.generations[0].generation_info or {}).get("headers")
+            if headers:
+                self._scheduler.update_from_headers(headers)
+        usage = (result.llm_output or {}).get("token_usage") or {}
+        self._scheduler.settle(estimated_tokens, usage.get("total_tokens"))
+
+    def _settle_failure(self, estimated_tokens: int, error: BaseException) -> None:
+        """Return the reserved tokens of a request that produced no completion."""
+        if isinstance(error, openai.RateLimitError):
+            self._scheduler.penalize(error.response.headers)
+        self._scheduler.settle(estimated_tokens, 0)
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager=None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        """Run the async implementation on the client loop and wait for it.
+
+        A blocking request cannot be interrupted, so the sync path reuses the
+        async one, where a losing hedge is cancelled and its request closed.
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            _in_context(
+                contextvars.copy_context(),
+                self._agenerate(messages, stop, run_manager, **kwargs),
+            ),
+            _client_loop(),
+        )
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
+
+    async def _aacquire(
+        self, messages, run_manager, expires_at: Optional[float]
+    ) -> Optional[int]:
+        """Wait for a scheduler slot. Returns the tokens reserved for the request."""
+        if self._scheduler is None:
+            return None
+        estimated_tokens, priority = self._schedule_params(messages, run_manager)
+        timeout = None if expires_at is None else expires_at - time.monotonic()
+        cancel = threading.Event()
+        acquiring = asyncio.ensure_future(
+            asyncio.to_thread(
+                self._scheduler.acquire, estimated_tokens, priority, timeout, cancel
+            )
+        )
+        try:
+            waited = await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # Withdraw the waiting thread from the queue, and hand back a slot
+            # it was given just before
+            self._scheduler.cancel(cancel)
+            acquiring.add_done_callback(
+                lambda future: future.cancelled()
+                or future.exception() is not None
+                or self._scheduler.release(estimated_tokens)
+            )
+            raise
+        self._log_wait(waited, priority)
+        return estimated_tokens
+
+    async def _asend(
+        self,
+        reserved_tokens: Optional[int],
+        messages,
+        stop,
+        run_manager,
+        expires_at: Optional[float],
+        **kwargs,
+    ) -> ChatResult:
+        """Send one request that already holds its scheduler slot."""
+        try:
+            timeout = self._attempt_timeout(expires_at)
+        except DeadlineExceeded:
+            if reserved_tokens is not None:
+                self._scheduler.release(reserved_tokens)
+            raise
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+
+        start = time.monotonic()
+        try:
+            result = await super()._agenerate(messages, stop, run_manager, **kwargs)
+        except BaseException as e:
+            if reserved_tokens is not None:
+                self._settle_failure(reserved_tokens, e)
+            raise
+        self._latencies.record(time.monotonic() - start)
+
+        if reserved_tokens is not None:
+            self._settle(reserved_tokens, result)
+        return result
+
+    async def _atimed_generate(
+        self, messages, stop, run_manager, expires_at, **kwargs
+    ) -> ChatResult:
+        reserved_tokens = await self._aacquire(messages, run_manager, expires_at)
+        return await self._asend(
+            reserved_tokens, messages, stop, run_manager, expires_at, **kwargs
+        )
+
+    async def _ahedged_generate(
+        self, messages, stop, run_manager, expires_at, **kwargs
+    ) -> ChatResult:
+        # The hedge timer starts once the first request holds its slot, so
+        # time spent queueing for the rate limit never triggers a hedge
+        reserved_tokens = await self._aacquire(messages, run_manager, expires_at)
+        pending = {
+            asyncio.create_task(
+                self._asend(
+                    reserved_tokens, messages, stop, run_manager, expires_at, **kwargs
+                )
+            )
+        }
+        try:
+            hedge_delay = self._hedge_delay(expires_at)
+            if hedge_delay is not None:
+                done, _ = await asyncio.wait(pending, timeout=hedge_delay)
+                if not done:
+                    logger.info(f"Hedging LLM call after {hedge_delay:.2f}s")
+                    pending.add(
+                        asyncio.create_task(
+                            self._atimed_generate(
+                                messages, stop, run_manager, expires_at, **kwargs
+                            )
+                        )
+                    )
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Cancelling closes the loser's HTTP request, or withdraws it from
+            # the scheduler queue if it is still waiting for a slot
+            for task in pending:
+                task.cancel()
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager=None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        expires_at = self._expires_at(kwargs)
+        model, probe = self._pick_model()
+        kwargs["model"] = model
+
+        attempt = 0
+        try:
+            while True:
+                try:
+                    with span("llm request", model=model, attempt=attempt):
+                        result = await self._ahedged_generate(
+                            messages, stop, run_manager, expires_at, **kwargs
+                        )
+                    self._record_outcome(model, None)
+                    return result
+                except Exception as e:
+                    self._record_outcome(model, e)
+                    await asyncio.sleep(self._backoff_or_raise(e, attempt, expires_at))
+                    attempt += 1
+        finally:
+            # Covers CancelledError and other BaseExceptions that skip the above
+            if probe:
+                self._breaker.release_probe()
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def _client_loop() -> asyncio.AbstractEventLoop:
+    """The event loop that runs sync LLM calls, started on first use.
+
+    One loop for all sync calls, so the clients' async HTTP connection pools
+    are only ever used from that loop.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="llm-client-loop", daemon=True
+            ).start()
+        return _loop
+
+
+async def _in_context(context: contextvars.Context, coroutine) -> Any:
+    """Await coroutine with the caller's context (e.g. the active profile)."""
+    return await asyncio.get_running_loop().create_task(coroutine, context=context)
 
 
 class AppSpec(BaseModel):
@@ -60,51 +413,76 @@ def insert_into_db(mini_app: MiniApp) -> bool:
     """Insert a MiniApp object into the database."""
     success = False
 
-    try:
-        session.add(mini_app)
-        session.commit()
-        success = True
-    except SQLAlchemyError as e:
-        session.rollback()
-        logger.error(f"Insertion failed: {str(e)}")
-    finally:
-        session.close()
+    with Session() as session:
+        try:
+            session.add(mini_app)
+            session.commit()
+            success = True
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Insertion failed: {str(e)}")
+
+    return success
+
+
+def insert_many_into_db(mini_apps: list[MiniApp]) -> bool:
+    """Insert several MiniApp objects in a single transaction."""
+    success = False
+
+    with Session() as session:
+        try:
+            session.add_all(mini_apps)
+            session.commit()
+            success = True
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Bulk insertion failed: {str(e)}")
 
     return success
 
 
 def update_app_in_db(
-    deployment_id: str, app_metadata: AppMetadata, new_deployment_id: str
+    deployment_id: str,
+    app_metadata: AppMetadata,
+    new_deployment_id: str,
+    app_jsx: Optional[str] = None,
 ) -> bool:
-    """Update an existing MiniApp record with new metadata and deployment_id."""
+    """Update an existing MiniApp record with new metadata and deployment_id.
+
+    When app_jsx is given, the new build is also recorded in the app's
+    version history.
+    """
     success = False
 
-    try:
-        # Find the existing app by deployment_id and update it
-        app = (
-            session.query(MiniApp)
-            .filter(MiniApp.deployment_id == deployment_id)
-            .first()
-        )
+    with Session() as session:
+        try:
+            # Find the existing app by deployment_id and update it
+            app = (
+                session.query(MiniApp)
+                .filter(MiniApp.deployment_id == deployment_id)
+                .first()
+            )
 
-        if app:
-            app.name = app_metadata.name
-            app.description = app_metadata.description
-            app.category = app_metadata.category
-            app.tags = app_metadata.tags
-            app.deployment_id = new_deployment_id
-            app.icon_url = app_metadata.app_icon
+            if app:
+                app.name = app_metadata.name
+                app.description = app_metadata.description
+                app.category = app_metadata.category
+                app.tags = app_metadata.tags
+                if app_jsx is not None:
+                    record_version(session, app, new_deployment_id, app_jsx)
+                app.deployment_id = new_deployment_id
+                app.icon_url = app_metadata.app_icon
 
-            session.commit()
-            success = True
-            logger.info(f"Successfully updated app with deployment_id: {deployment_id}")
-        else:
-            logger.error(f"App with deployment_id {deployment_id} not found")
-
-    except SQLAlchemyError as e:
-        session.rollback()
-        logger.error(f"Update failed: {str(e)}")
-    finally:
-        session.close()
+                session.commit()
+                success = True
+                logger.info(
+                    f"Successfully updated app with deployment_id: {deployment_id}"
+                )
+            else:
+                logger.error(f"App with deployment_id {deployment_id} not found")
+
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Update failed: {str(e)}")
 
     return success
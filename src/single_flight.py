@@ -0,0 +1,83 @@
+"""Request coalescing and idempotency for generate/edit calls."""
+
+import asyncio
+import hashlib
+import os
+import time
+from functools import partial
+from typing import Any, Awaitable, Callable, Optional
+
+from log import logger
+
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "600"))
+
+
+def request_key(
+    operation: str,
+    user_request: str,
+    deployment_id: Optional[str] = None,
+    idempotency_key: Optional[str] = None,
+) -> str:
+    """Build the coalescing key for a request.
+
+    An explicit idempotency key wins; otherwise the key is a hash of the
+    whitespace/case-normalized request and the deployment it targets.
+    """
+    if idempotency_key:
+        return f"{operation}:key:{idempotency_key}"
+
+    normalized = " ".join(user_request.lower().split())
+    digest = hashlib.sha256(f"{normalized}\0{deployment_id or ''}".encode("utf-8"))
+    return f"{operation}:{digest.hexdigest()}"
+
+
+class SingleFlight:
+    """Run at most one job per key and remember successful results for a while.
+
+    Concurrent callers with the same key await the same in-flight task; callers
+    arriving within ``ttl`` seconds after it succeeded get the stored result.
+    Failed jobs are not stored, so a retry after a failure runs again. State is
+    per process.
+    """
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL_SECONDS):
+        self.ttl = ttl
+        self._in_flight: dict[str, asyncio.Future] = {}
+        self._results: dict[str, tuple[float, Any]] = {}
+
+    def _evict_expired(self) -> None:
+        now = time.monotonic()
+        for key in [
+            k for k, (expires_at, _) in self._results.items() if expires_at <= now
+        ]:
+            del self._results[key]
+
+    def _on_done(self, key: str, task: asyncio.Future) -> None:
+        self._in_flight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+
+        result = task.result()
+        if isinstance(result, dict) and (
+            "error" in result or result.get("success") is False
+        ):
+            return
+        self._results[key] = (time.monotonic() + self.ttl, result)
+
+    async def run(self, key: str, job: Callable[[], Awaitable[Any]]) -> Any:
+        self._evict_expired()
+
+        if key in self._results:
+            logger.info(f"Returning stored result for {key}")
+            return self._results[key][1]
+
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(job())
+            self._in_flight[key] = task
+            task.add_done_callback(partial(self._on_done, key))
+        else:
+            logger.info(f"Attaching to in-flight job for {key}")
+
+        # Shield so a disconnecting caller does not cancel the shared job
+        return await asyncio.shield(task)
@@ -0,0 +1,138 @@
+"""Storage backends for deployment files."""
+
+import os
+import shutil
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+from log import logger
+from src.supabase import supabase
+
+BUCKET = "apps"
+LIST_PAGE_SIZE = 1000
+
+
+@dataclass
+class StoredObject:
+    """An entry returned by StorageBackend.list_dir (a file or a folder)."""
+
+    name: str
+    created_at: Optional[datetime] = None
+
+
+class StorageBackend:
+    """Minimal object storage interface used for deployment files."""
+
+    def upload(self, path: str, file: Path) -> None:
+        raise NotImplementedError
+
+    def download(self, path: str) -> Optional[bytes]:
+        """Return the object at path, or None if it does not exist."""
+        raise NotImplementedError
+
+    def list_dir(self, path: str) -> list[StoredObject]:
+        """Return the entries directly under path."""
+        raise NotImplementedError
+
+    def delete(self, paths: list[str]) -> None:
+        raise NotImplementedError
+
+
+class SupabaseStorage(StorageBackend):
+    """Supabase storage bucket (the default)."""
+
+    def __init__(self, bucket: str = BUCKET):
+        self.bucket = supabase.storage.from_(bucket)
+
+    def upload(self, path: str, file: Path) -> None:
+        self.bucket.upload(file=file, path=path)
+
+    def download(self, path: str) -> Optional[bytes]:
+        try:
+            return self.bucket.download(path)
+        except Exception as e:
+            logger.warning(f"Storage download failed for {path}: {e}")
+            return None
+
+    def list_dir(self, path: str) -> list[StoredObject]:
+        entries = []
+        while True:
+            page = self.bucket.list(
+                path, {"limit": LIST_PAGE_SIZE, "offset": len(entries)}
+            )
+            entries.extend(
+                StoredObject(
+                    name=item["name"],
+                    created_at=(
+                        datetime.fromisoformat(item["created_at"])
+                        if item.get("created_at")
+                        else None
+                    ),
+                )
+                for item in page
+            )
+            if len(page) < LIST_PAGE_SIZE:
+                return entries
+
+    def delete(self, paths: list[str]) -> None:
+        self.bucket.remove(paths)
+
+
+class LocalStorage(StorageBackend):
+    """Filesystem storage rooted at a directory, for offline use and testing."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root).resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _resolve(self, path: str) -> Path:
+        resolved = (self.root / path).resolve()
+        if not resolved.is_relative_to(self.root):
+            raise ValueError(f"Path escapes storage root: {path}")
+        return resolved
+
+    def upload(self, path: str, file: Path) -> None:
+        target = self._resolve(path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(file, target)
+
+    def download(self, path: str) -> Optional[bytes]:
+        target = self._resolve(path)
+        return target.read_bytes() if target.is_file() else None
+
+    def list_dir(self, path: str) -> list[StoredObject]:
+        target = self._resolve(path)
+        if not target.is_dir():
+            return []
+        return [
+            StoredObject(
+                name=child.name,
+                created_at=datetime.fromtimestamp(
+                    child.stat().st_mtime, tz=timezone.utc
+                ),
+            )
+            for child in target.iterdir()
+        ]
+
+    def delete(self, paths: list[str]) -> None:
+        for path in paths:
+            target = self._resolve(path)
+            target.unlink(missing_ok=True)
+            # Drop folders left empty, as object stores have no real folders
+            if target.parent != self.root:
+                try:
+                    target.parent.rmdir()
+                except OSError:
+                    pass
+
+
+def get_storage() -> StorageBackend:
+    """Pick the backend from DEPLOYMENT_STORAGE ("supabase" or "local")."""
+    if os.getenv("DEPLOYMENT_STORAGE", "supabase") == "local":
+        return LocalStorage(os.getenv("DEPLOYMENT_STORAGE_DIR", "./storage"))
+    return SupabaseStorage()
+
+
+storage = get_storage()
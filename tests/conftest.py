@@ -0,0 +1,11 @@
+import os
+import tempfile
+
+# Modules connect to Supabase/Postgres on import; keep the tests offline
+os.environ.setdefault("SUPABASE_URL", "http://localhost")
+os.environ.setdefault("SUPABASE_KEY", "test")
+os.environ.setdefault("POSTGRES_URL", "sqlite://")
+os.environ.setdefault("OPENROUTER_API_KEY", "test")
+os.environ.setdefault("DEPLOYMENT_STORAGE", "local")
+os.environ.setdefault("DEPLOYMENT_STORAGE_DIR", tempfile.mkdtemp(prefix="storage-"))
+os.environ.setdefault("COUNTER_LOG_DIR", tempfile.mkdtemp(prefix="counters-"))
@@ -0,0 +1,94 @@
+"""The fast-path bundler must produce the same page as the Vite build."""
+
+import time
+from pathlib import Path
+
+import pytest
+
+TEMPLATE_DIR = Path(__file__).resolve().parent.parent / "template-web-app"
+
+pytestmark = pytest.mark.skipif(
+    not (TEMPLATE_DIR / "node_modules").is_dir(),
+    reason="template-web-app dependencies are not installed (run npm ci there)",
+)
+
+PLAIN_APP = """import { useState } from "react";
+
+export default function App() {
+  const [count, setCount] = useState(0);
+  return (
+    <div className="min-h-screen flex flex-col items-center justify-center bg-slate-100 p-4">
+      <h1 className="text-2xl font-bold text-slate-800">Counter</h1>
+      <button
+        className="mt-4 rounded-lg bg-blue-500 px-4 py-2 text-white hover:bg-blue-600"
+        onClick={() => setCount(count + 1)}
+      >
+        Clicked {count} times
+      </button>
+    </div>
+  );
+}
+"""
+
+STORE_APP = """import { useStore } from "./useStore";
+
+export default function App() {
+  const [notes, setNotes] = useStore("notes", []);
+  return (
+    <ul className="divide-y divide-gray-200 p-6">
+      {(notes || []).map((note, index) => (
+        <li key={index} className="py-2 text-sm text-gray-700">
+          {note}
+        </li>
+      ))}
+      <button className="mt-2 text-emerald-600" onClick={() => setNotes([...(notes || []), "note"])}>
+        Add
+      </button>
+    </ul>
+  );
+}
+"""
+
+# Logged by useStore.ts once linkBridge connects; survives minification
+BRIDGE_MARKER = "Bridge is ready"
+
+
+@pytest.fixture(scope="module")
+def build():
+    from src.js_bundle_upload import main
+
+    def build(app_jsx: str) -> tuple[str, str]:
+        start = time.perf_counter()
+        fast_html = main.fast_bundler.bundle(app_jsx)
+        fast_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        service = main.BuildService()
+        app_dir = service.copy_template_with_custom_index(
+            main.TEMPLATE_APP_DIR, app_jsx
+        )
+        try:
+            service.run_html_export(app_dir)
+            vite_html = (app_dir / "dist" / "index.html").read_text(encoding="utf-8")
+        finally:
+            service.cleanup_temp_directory(app_dir.parent)
+        vite_seconds = time.perf_counter() - start
+
+        # Shown with pytest -s; the first fast build includes worker startup
+        print(f"\nfast path {fast_seconds:.2f}s, vite {vite_seconds:.2f}s")
+        return vite_html, fast_html
+
+    yield build
+    main.fast_bundler.close()
+
+
+@pytest.mark.parametrize("app_jsx", [PLAIN_APP, STORE_APP], ids=["plain", "store"])
+def test_fast_path_matches_vite(build, app_jsx):
+    from src.js_bundle_upload.fast_path import compare_builds
+
+    vite_html, fast_html = build(app_jsx)
+    report = compare_builds(vite_html, fast_html)
+    assert report["equivalent"], report
+    # The bridge is only linked when App.jsx uses useStore
+    assert (BRIDGE_MARKER in fast_html) == (BRIDGE_MARKER in vite_html)
+    assert (BRIDGE_MARKER in fast_html) == (app_jsx is STORE_APP)
@@ -0,0 +1,261 @@
+"""OpenRouterClient retries, deadlines, hedging, circuit breaking and rate
+limiting, against a local OpenAI-compatible stub server."""
+
+import json
+import select
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+import pytest
+
+from src.rn_gen.resilience import CircuitBreaker, CircuitOpenError, DeadlineExceeded
+from src.rn_gen.scheduler import RateLimitScheduler
+from src.rn_gen.utils import OpenRouterClient
+
+COMPLETION = {
+    "id": "stub",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "stub",
+    "choices": [
+        {
+            "index": 0,
+            "message": {"role": "assistant", "content": "ok"},
+            "finish_reason": "stop",
+        }
+    ],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+}
+
+
+class StubServer:
+    """Answers each /chat/completions request with the next scripted reply.
+
+    A reply is (status, delay); once the script runs out every request gets
+    (200, 0). A delayed reply whose client hangs up first counts as aborted.
+    """
+
+    def __init__(self):
+        self.replies: list[tuple[int, float]] = []
+        self.models: list[str] = []
+        self.aborted = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    @property
+    def requests(self) -> int:
+        return len(self.models)
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with stub._lock:
+                    stub.models.append(body["model"])
+                    status, delay = stub.replies.pop(0) if stub.replies else (200, 0)
+
+                if not self._wait_connected(delay):
+                    with stub._lock:
+                        stub.aborted += 1
+                    return
+
+                payload = (
+                    COMPLETION if status == 200 else {"error": {"message": "stub"}}
+                )
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _wait_connected(self, delay: float) -> bool:
+                """Sleep for delay; False if the client closed the connection."""
+                deadline = time.monotonic() + delay
+                while (remaining := deadline - time.monotonic()) > 0:
+                    readable, _, _ = select.select(
+                        [self.connection], [], [], min(remaining, 0.02)
+                    )
+                    if readable and not self.connection.recv(1, socket.MSG_PEEK):
+                        return False
+                return True
+
+        return Handler
+
+
+@pytest.fixture
+def stub():
+    server = StubServer()
+    yield server
+    server.close()
+
+
+def make_client(stub: StubServer, **kwargs) -> OpenRouterClient:
+    kwargs.setdefault("scheduler", None)
+    kwargs.setdefault("retry_base_delay", 0.01)
+    kwargs.setdefault("retry_max_delay", 0.02)
+    return OpenRouterClient(model="stub/primary", base_url=stub.url, **kwargs)
+
+
+def prime_hedging(client: OpenRouterClient, latency: float) -> None:
+    for _ in range(client.hedge_min_samples):
+        client._latencies.record(latency)
+
+
+def test_retries_retriable_errors(stub):
+    stub.replies = [(500, 0), (429, 0)]
+    client = make_client(stub, retry_attempts=2)
+
+    assert client.invoke("hi").content == "ok"
+    assert stub.requests == 3
+
+
+def test_does_not_retry_client_errors(stub):
+    stub.replies = [(400, 0)]
+    client = make_client(stub, retry_attempts=2)
+
+    with pytest.raises(openai.BadRequestError):
+        client.invoke("hi")
+    assert stub.requests == 1
+
+
+def test_deadline_bounds_attempts_and_retries(stub):
+    stub.replies = [(200, 5.0)] * 5
+    client = make_client(stub, deadline=0.5, retry_attempts=5)
+
+    start = time.monotonic()
+    with pytest.raises((openai.APITimeoutError, DeadlineExceeded)):
+        client.invoke("hi")
+    assert time.monotonic() - start < 1.5
+
+
+def test_hedge_wins_and_cancels_the_slow_request(stub):
+    stub.replies = [(200, 2.0)]
+    client = make_client(stub)
+    prime_hedging(client, 0.05)
+
+    start = time.monotonic()
+    assert client.invoke("hi").content == "ok"
+    assert time.monotonic() - start < 1.0
+    assert stub.requests == 2
+
+    # The losing request's connection is closed rather than left running
+    time.sleep(0.3)
+    assert stub.aborted == 1
+
+
+def test_breaker_opens_then_recovers_through_a_probe(stub):
+    stub.replies = [(500, 0), (500, 0)]
+    client = make_client(
+        stub,
+        retry_attempts=0,
+        breaker_failure_threshold=2,
+        breaker_recovery_timeout=0.2,
+    )
+
+    for _ in range(2):
+        with pytest.raises(openai.InternalServerError):
+            client.invoke("hi")
+    assert client._breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(CircuitOpenError):
+        client.invoke("hi")
+    assert stub.requests == 2
+
+    time.sleep(0.25)
+    assert client.invoke("hi").content == "ok"
+    assert client._breaker.state == CircuitBreaker.CLOSED
+
+
+def test_open_breaker_routes_to_the_fallback_model(stub):
+    stub.replies = [(500, 0)]
+    client = make_client(
+        stub,
+        retry_attempts=0,
+        breaker_failure_threshold=1,
+        fallback_model="stub/fallback",
+    )
+
+    with pytest.raises(openai.InternalServerError):
+        client.invoke("hi")
+    assert client.invoke("hi").content == "ok"
+    assert stub.models == ["stub/primary", "stub/fallback"]
+
+
+def test_failed_probe_does_not_wedge_the_breaker(stub):
+    stub.replies = [(500, 0), (400, 0)]
+    client = make_client(
+        stub,
+        retry_attempts=0,
+        breaker_failure_threshold=1,
+        breaker_recovery_timeout=0.1,
+    )
+
+    with pytest.raises(openai.InternalServerError):
+        client.invoke("hi")
+    time.sleep(0.15)
+    with pytest.raises(openai.BadRequestError):
+        client.invoke("hi")
+    assert client.invoke("hi").content == "ok"
+
+
+def test_scheduler_wait_respects_the_deadline(stub):
+    scheduler = RateLimitScheduler(requests_per_minute=1, tokens_per_minute=10**6)
+    client = make_client(stub, scheduler=scheduler, deadline=1.0)
+    client.invoke("hi")
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        client.invoke("hi")
+    assert time.monotonic() - start < 1.5
+    assert stub.requests == 1
+    assert scheduler.stats()["queue_depth"] == 0
+    # Waiting out the rate limit is not an upstream failure
+    assert client._breaker.state == CircuitBreaker.CLOSED
+
+
+def test_queueing_does_not_trigger_a_hedge(stub):
+    scheduler = RateLimitScheduler(requests_per_minute=60, tokens_per_minute=10**6)
+    scheduler._requests = 0.0
+    client = make_client(stub, scheduler=scheduler)
+    prime_hedging(client, 0.05)
+
+    client.invoke("hi")
+    time.sleep(1.2)
+    assert stub.requests == 1
+    # No duplicate ever joined the queue
+    assert len(scheduler._waits) == 1
+
+
+def test_losing_hedge_waiting_for_a_slot_never_sends(stub):
+    scheduler = RateLimitScheduler(requests_per_minute=30, tokens_per_minute=10**6)
+    scheduler._requests = 1.0
+    stub.replies = [(200, 0.5)]
+    client = make_client(stub, scheduler=scheduler)
+    prime_hedging(client, 0.05)
+
+    assert client.invoke("hi").content == "ok"
+    time.sleep(2.5)
+    assert stub.requests == 1
+    assert scheduler.stats()["queue_depth"] == 0
+    # The hedge left the queue without taking the slot that refilled meanwhile
+    assert len(scheduler._waits) == 1
+    assert scheduler.stats()["requests_available"] >= 1